@@ -183,6 +183,13 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_ENABLE_UTC = False
 CELERY_WORKER_POOL = os.getenv('CELERY_WORKER_POOL', 'solo')
+# Les taches IA durent longtemps : un worker n'en reserve qu'une a la fois
+# et elles ont leur propre file pour ne pas bloquer les autres taches.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_AI_ASSETS_QUEUE = os.getenv('CELERY_AI_ASSETS_QUEUE', 'ai_assets')
+CELERY_TASK_ROUTES = {
+    'inventory.tasks.generate_product_assets': {'queue': CELERY_AI_ASSETS_QUEUE},
+}
 
 MISTRAL_AGENT_ID = os.getenv('MISTRAL_AGENT_ID')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
@@ -198,8 +205,13 @@ GOOGLE_CSE_ENDPOINT = os.getenv(
 SERPER_API_KEY = os.getenv("SERPER_API_KEY")
 SERPER_IMAGE_ENDPOINT = os.getenv("SERPER_IMAGE_ENDPOINT", "https://google.serper.dev/images")
 HIKVISION_DATASHEET_MAX_MB = int(os.getenv("HIKVISION_DATASHEET_MAX_MB", "20"))
-HIKVISION_DATASHEET_SLEEP = float(os.getenv("HIKVISION_DATASHEET_SLEEP", "1.0"))
 HIKVISION_DATASHEET_HTML_LIMIT_KB = int(os.getenv("HIKVISION_DATASHEET_HTML_LIMIT_KB", "512"))
+HIKVISION_DATASHEET_WORKERS = int(os.getenv("HIKVISION_DATASHEET_WORKERS", "4"))
+HIKVISION_DATASHEET_TRUSTED_HOSTS = _env_list("HIKVISION_DATASHEET_TRUSTED_HOSTS", "")
+# Debit maximal (requetes/seconde) par hote ; 0 desactive la limite.
+SERPER_QPS = float(os.getenv("SERPER_QPS", "5"))
+GOOGLE_CSE_QPS = float(os.getenv("GOOGLE_CSE_QPS", "1"))
+PDF_DOWNLOAD_QPS = float(os.getenv("PDF_DOWNLOAD_QPS", "2"))
 PRODUCT_BOT_IMAGE_URL_TEMPLATE = os.getenv(
     'PRODUCT_BOT_IMAGE_URL_TEMPLATE',
     '',
@@ -15,16 +15,16 @@ from inventory.models import Category, Product, SubCategory
 from inventory.bot import MistralTextGenerator
 
 
-UNCATEGORIZED_TOKENS = {
+UNCATEGORIZED_TOKENS = frozenset({
     "non classe",
     "non classee",
     "uncategorized",
     "uncategorised",
     "sans categorie",
     "sans categoriee",
-}
+})
 
-STOPWORDS = {
+STOPWORDS = frozenset({
     "de",
     "du",
     "des",
@@ -37,7 +37,7 @@ STOPWORDS = {
     "sans",
     "sur",
     "d",
-}
+})
 
 BRAND_ALIASES = {
     "hikvision": ("hikvision", "hik-vision"),
@@ -178,9 +178,11 @@ def _normalize(text: str) -> str:
     return " ".join(text.split())
 
 
+_UNCATEGORIZED_NORM = frozenset(_normalize(token) for token in UNCATEGORIZED_TOKENS)
+
+
 def _is_uncategorized(name: str) -> bool:
-    normalized = _normalize(name)
-    return normalized in UNCATEGORIZED_TOKENS
+    return _normalize(name) in _UNCATEGORIZED_NORM
 
 
 @dataclass
@@ -269,8 +271,14 @@ def _load_rules(path: Path) -> tuple[list[Rule], str | None]:
     return rules, default_category
 
 
-def _pick_best_rule(rules: Iterable[Rule], raw_text: str) -> Rule | None:
-    normalized_text = _normalize(raw_text)
+def _pick_best_rule(
+    rules: Iterable[Rule],
+    raw_text: str,
+    *,
+    normalized_text: str | None = None,
+) -> Rule | None:
+    if normalized_text is None:
+        normalized_text = _normalize(raw_text)
     tokens = set(normalized_text.split())
     best_rule = None
     best_signature = (0, 0, 0, "")
@@ -387,9 +395,157 @@ def run_auto_assign_categories(
         if max_details is None or len(evaluations) < max_details:
             evaluations.append(entry)
 
+    def _apply_suggestion(
+        product: Product,
+        current_category: str,
+        suggested_category: str | None,
+        target_category: Category | None,
+        source: str,
+        ai_suggestion: AICategorySuggestion | None = None,
+    ) -> None:
+        nonlocal updated, skipped, unmatched, ai_used, data_used, subcategories_created
+        if suggested_category:
+            if target_category is None:
+                target_category = categories_by_name.get(suggested_category)
+            if target_category:
+                target_subcategory = None
+                if source == "mistral" and ai_suggestion and ai_suggestion.subcategory:
+                    target_subcategory, created_subcategory = SubCategory.objects.get_or_create(
+                        category=target_category,
+                        name=ai_suggestion.subcategory,
+                    )
+                    if created_subcategory:
+                        subcategories_created += 1
+                if product.category_id == target_category.id:
+                    if (
+                        (product.subcategory_id or None)
+                        != (target_subcategory.id if target_subcategory else None)
+                    ):
+                        if not dry_run:
+                            product.subcategory = target_subcategory
+                            product.save(update_fields=["subcategory"])
+                        updated += 1
+                        if source == "mistral":
+                            ai_used += 1
+                        _append_evaluation(
+                            {
+                                "product_id": product.id,
+                                "sku": product.sku,
+                                "name": product.name,
+                                "current_category": current_category,
+                                "suggested_category": suggested_category,
+                                "suggested_subcategory": target_subcategory.name,
+                                "status": "updated",
+                                "source": source,
+                            }
+                        )
+                        return
+                    skipped += 1
+                    _append_evaluation(
+                        {
+                            "product_id": product.id,
+                            "sku": product.sku,
+                            "name": product.name,
+                            "current_category": current_category,
+                            "suggested_category": suggested_category,
+                            "suggested_subcategory": target_subcategory.name if target_subcategory else "",
+                            "status": "skipped",
+                            "source": source,
+                        }
+                    )
+                    return
+                if dry_run:
+                    changes.append(
+                        {
+                            "product_id": product.id,
+                            "sku": product.sku,
+                            "name": product.name,
+                            "category": suggested_category,
+                        }
+                    )
+                    change_lines.append(f"{product.sku} -> {suggested_category}")
+                else:
+                    product.category = target_category
+                    product.subcategory = target_subcategory
+                    product.save(update_fields=["category", "subcategory"])
+                updated += 1
+                if source == "mistral":
+                    ai_used += 1
+                if source == "data":
+                    data_used += 1
+                _append_evaluation(
+                    {
+                        "product_id": product.id,
+                        "sku": product.sku,
+                        "name": product.name,
+                        "current_category": current_category,
+                        "suggested_category": suggested_category,
+                        "suggested_subcategory": target_subcategory.name if target_subcategory else "",
+                        "status": "updated",
+                        "source": source,
+                    }
+                )
+                return
+        unmatched += 1
+        _append_evaluation(
+            {
+                "product_id": product.id,
+                "sku": product.sku,
+                "name": product.name,
+                "current_category": current_category,
+                "suggested_category": "",
+                "status": "unmatched",
+                "source": source,
+            }
+        )
+
+    # Les produits sans regle ni indice sont envoyes a Mistral par lots pour
+    # partager un seul aller-retour reseau entre plusieurs decisions.
+    ai_batch_size = max(1, int(getattr(settings, "CATEGORY_AI_BATCH_SIZE", 16)))
+    ai_queue: list[tuple[Product, str]] = []
+
+    def _flush_ai_queue() -> None:
+        nonlocal ai_attempted, categories_created
+        if not ai_queue:
+            return
+        batch = list(ai_queue)
+        ai_queue.clear()
+        ai_attempted += len(batch)
+        suggestions = _ai_pick_categories_batch(
+            ai_generator,
+            [product for product, _ in batch],
+            candidate_categories,
+        )
+        for (product, current_category), ai_suggestion in zip(batch, suggestions):
+            suggested_category = None
+            target_category = None
+            if ai_suggestion:
+                suggested_category = ai_suggestion.category
+                target_category = categories_by_name.get(suggested_category)
+                if not target_category and ai_allow_create:
+                    target_category, created_category = Category.objects.get_or_create(
+                        name=suggested_category
+                    )
+                    if created_category:
+                        categories_created += 1
+                    categories_by_name[target_category.name] = target_category
+                    candidate_categories.append(target_category)
+                    category_hints[target_category.id] = {
+                        "category": target_category,
+                        "weights": Counter(_tokenize_text(target_category.name)),
+                    }
+            _apply_suggestion(
+                product,
+                current_category,
+                suggested_category,
+                target_category,
+                "mistral",
+                ai_suggestion,
+            )
+
     for product in products:
-        raw_text = _build_match_text(product)
-        rule = _pick_best_rule(rules, raw_text)
+        match = _match_text(product)
+        rule = _pick_best_rule(rules, match.raw, normalized_text=match.normalized)
         current_category = (
             product.category.name if getattr(product, "category", None) else ""
         )
@@ -397,7 +553,9 @@ def run_auto_assign_categories(
             suggested_category = None
             target_category = None
             source = "rules"
-            brand_category = _brand_override_category(product, candidate_categories)
+            brand_category = _brand_override_category(
+                product, candidate_categories, match=match
+            )
             if brand_category:
                 suggested_category = brand_category.name
                 target_category = brand_category
@@ -407,131 +565,23 @@ def run_auto_assign_categories(
                     product,
                     category_hints,
                     hint_min_score,
+                    match=match,
                 )
                 if data_category:
                     suggested_category = data_category.name
                     target_category = data_category
                     source = "data"
                 elif use_ai and ai_generator and candidate_categories:
-                    ai_attempted += 1
-                    ai_suggestion = _ai_pick_category_with_subcategory(
-                        ai_generator,
-                        product,
-                        candidate_categories,
-                    )
-                    source = "mistral"
-                    suggested_subcategory = None
-                    if ai_suggestion:
-                        suggested_category = ai_suggestion.category
-                        suggested_subcategory = ai_suggestion.subcategory
-                        target_category = categories_by_name.get(suggested_category)
-                        if not target_category and ai_allow_create:
-                            target_category, created_category = Category.objects.get_or_create(
-                                name=suggested_category
-                            )
-                            if created_category:
-                                categories_created += 1
-                            categories_by_name[target_category.name] = target_category
-                            candidate_categories.append(target_category)
-                            category_hints[target_category.id] = {
-                                "category": target_category,
-                                "weights": Counter(_tokenize_text(target_category.name)),
-                            }
-                    else:
-                        suggested_subcategory = None
-            if suggested_category:
-                if target_category is None:
-                    target_category = categories_by_name.get(suggested_category)
-                if target_category:
-                    target_subcategory = None
-                    if source == "mistral" and ai_suggestion and ai_suggestion.subcategory:
-                        target_subcategory, created_subcategory = SubCategory.objects.get_or_create(
-                            category=target_category,
-                            name=ai_suggestion.subcategory,
-                        )
-                        if created_subcategory:
-                            subcategories_created += 1
-                    if product.category_id == target_category.id:
-                        if (
-                            (product.subcategory_id or None)
-                            != (target_subcategory.id if target_subcategory else None)
-                        ):
-                            if not dry_run:
-                                product.subcategory = target_subcategory
-                                product.save(update_fields=["subcategory"])
-                            updated += 1
-                            if source == "mistral":
-                                ai_used += 1
-                            _append_evaluation(
-                                {
-                                    "product_id": product.id,
-                                    "sku": product.sku,
-                                    "name": product.name,
-                                    "current_category": current_category,
-                                    "suggested_category": suggested_category,
-                                    "suggested_subcategory": target_subcategory.name,
-                                    "status": "updated",
-                                    "source": source,
-                                }
-                            )
-                            continue
-                        skipped += 1
-                        _append_evaluation(
-                            {
-                                "product_id": product.id,
-                                "sku": product.sku,
-                                "name": product.name,
-                                "current_category": current_category,
-                                "suggested_category": suggested_category,
-                                "suggested_subcategory": target_subcategory.name if target_subcategory else "",
-                                "status": "skipped",
-                                "source": source,
-                            }
-                        )
-                        continue
-                    if dry_run:
-                        changes.append(
-                            {
-                                "product_id": product.id,
-                                "sku": product.sku,
-                                "name": product.name,
-                                "category": suggested_category,
-                            }
-                        )
-                        change_lines.append(f"{product.sku} -> {suggested_category}")
-                    else:
-                        product.category = target_category
-                        product.subcategory = target_subcategory
-                        product.save(update_fields=["category", "subcategory"])
-                    updated += 1
-                    if source == "mistral":
-                        ai_used += 1
-                    if source == "data":
-                        data_used += 1
-                    _append_evaluation(
-                        {
-                            "product_id": product.id,
-                            "sku": product.sku,
-                            "name": product.name,
-                            "current_category": current_category,
-                            "suggested_category": suggested_category,
-                            "suggested_subcategory": target_subcategory.name if target_subcategory else "",
-                            "status": "updated",
-                            "source": source,
-                        }
-                    )
+                    ai_queue.append((product, current_category))
+                    if len(ai_queue) >= ai_batch_size:
+                        _flush_ai_queue()
                     continue
-            unmatched += 1
-            _append_evaluation(
-                {
-                    "product_id": product.id,
-                    "sku": product.sku,
-                    "name": product.name,
-                    "current_category": current_category,
-                    "suggested_category": "",
-                    "status": "unmatched",
-                    "source": source,
-                }
+            _apply_suggestion(
+                product,
+                current_category,
+                suggested_category,
+                target_category,
+                source,
             )
             continue
         suggested_category = rule.category.name
@@ -576,6 +626,8 @@ def run_auto_assign_categories(
             product.save(update_fields=["category", "subcategory"])
         updated += 1
 
+    _flush_ai_queue()
+
     evaluations_truncated = (
         max_details is not None and len(products) > len(evaluations)
     )
@@ -626,6 +678,28 @@ def _build_match_text(product: Product) -> str:
     return " ".join(part for part in parts if part)
 
 
+@dataclass
+class _MatchText:
+    raw: str
+    raw_upper: str
+    normalized: str
+    tokens: set[str]
+    hint_tokens: list[str]
+
+
+def _match_text(product: Product) -> _MatchText:
+    """Build every representation of the product text used by the matchers once."""
+    raw = _build_match_text(product)
+    normalized = _normalize(raw)
+    return _MatchText(
+        raw=raw,
+        raw_upper=raw.upper(),
+        normalized=normalized,
+        tokens=set(normalized.split()),
+        hint_tokens=_filter_tokens(normalized),
+    )
+
+
 def _build_hint_text(row: dict) -> str:
     description = (row.get("description") or "").strip()
     if len(description) > 400:
@@ -643,7 +717,10 @@ def _build_hint_text(row: dict) -> str:
 
 
 def _tokenize_text(text: str) -> list[str]:
-    normalized = _normalize(text)
+    return _filter_tokens(_normalize(text))
+
+
+def _filter_tokens(normalized: str) -> list[str]:
     tokens = []
     for token in normalized.split():
         if not token or token in STOPWORDS:
@@ -714,11 +791,12 @@ def _data_driven_category(
     product: Product,
     hints: dict[int, dict],
     min_score: int,
+    *,
+    match: _MatchText | None = None,
 ) -> Category | None:
     if not hints:
         return None
-    text = _build_match_text(product)
-    tokens = _tokenize_text(text)
+    tokens = (match or _match_text(product)).hint_tokens
     if not tokens:
         return None
     best_category = None
@@ -742,15 +820,17 @@ def _data_driven_category(
 def _brand_override_category(
     product: Product,
     categories: list[Category],
+    *,
+    match: _MatchText | None = None,
 ) -> Category | None:
     if not categories:
         return None
-    raw_text = _build_match_text(product)
-    normalized_text = _normalize(raw_text)
+    match = match or _match_text(product)
+    normalized_text = match.normalized
     brand = _detect_brand(product, normalized_text)
     if not brand:
         return None
-    raw_upper = raw_text.upper()
+    raw_upper = match.raw_upper
     door_patterns = BRAND_DOOR_STATION_PATTERNS.get(brand, ())
     if _matches_patterns(raw_upper, door_patterns) or _has_any_keyword(
         normalized_text, DOOR_STATION_KEYWORDS
@@ -896,12 +976,62 @@ def _ai_pick_category_with_subcategory(
     return _parse_ai_response_with_subcategory(response, candidates)
 
 
+def _ai_pick_categories_batch(
+    generator: MistralTextGenerator,
+    products: list[Product],
+    categories: list[Category],
+) -> list[AICategorySuggestion | None]:
+    if not products:
+        return []
+    if len(products) == 1 or not categories:
+        return [
+            _ai_pick_category_with_subcategory(generator, product, categories)
+            for product in products
+        ]
+    max_candidates = int(getattr(settings, "CATEGORY_AI_MAX_CANDIDATES", 80))
+    candidates: list[str] = []
+    seen: set[str] = set()
+    for product in products:
+        for name in _rank_categories(product, categories, max_candidates):
+            if name not in seen:
+                seen.add(name)
+                candidates.append(name)
+    if not candidates:
+        return [None] * len(products)
+    prompt = _build_ai_batch_prompt(products, candidates, categories)
+    response = generator.generate_text(
+        prompt,
+        temperature=float(getattr(settings, "CATEGORY_AI_TEMPERATURE", 0.2)),
+        max_tokens=int(getattr(settings, "CATEGORY_AI_MAX_TOKENS", 120)) * len(products),
+    )
+    if not response:
+        # Appel en echec (panne, quota) : les appels unitaires echoueraient
+        # aussi, le lot reste sans suggestion.
+        return [None] * len(products)
+    parsed = _parse_ai_batch_response(response, candidates)
+    if parsed is None:
+        # Reponse illisible : on retombe sur un appel par produit.
+        return [
+            _ai_pick_category_with_subcategory(generator, product, categories)
+            for product in products
+        ]
+    results: list[AICategorySuggestion | None] = []
+    for index, product in enumerate(products, start=1):
+        if index in parsed:
+            results.append(parsed[index])
+        else:
+            results.append(
+                _ai_pick_category_with_subcategory(generator, product, categories)
+            )
+    return results
+
+
 def _rank_categories(
     product: Product, categories: list[Category], max_candidates: int
 ) -> list[str]:
-    raw_text = _build_match_text(product)
-    normalized_text = _normalize(raw_text)
-    tokens = set(normalized_text.split())
+    match = _match_text(product)
+    normalized_text = match.normalized
+    tokens = match.tokens
     scored = []
     for category in categories:
         normalized = _normalize(category.name)
@@ -928,6 +1058,39 @@ def _build_ai_prompt_with_subcategory(
     candidates: list[str],
     categories: list[Category],
 ) -> str:
+    details = _product_prompt_details(product)
+    category_block = "\n".join(f"- {name}" for name in candidates)
+    subcategory_block = _build_subcategory_block(candidates, categories)
+    return (
+        "Tu es un assistant qui choisit la meilleure categorie et sous-categorie pour un produit.\n"
+        "Tu peux reutiliser une categorie existante ou en proposer une nouvelle si rien ne convient.\n"
+        "Reponds uniquement en JSON sur une seule ligne: "
+        '{"category":"...","subcategory":"..."}. '
+        "Si la sous-categorie n'est pas utile, mets null.\n\n"
+        + "\n".join(details)
+        + "\n\nCategories disponibles:\n"
+        + category_block
+        + "\n\nSous-categories connues:\n"
+        + (subcategory_block or "(aucune)")
+    )
+
+
+def _build_subcategory_block(candidates: list[str], categories: list[Category]) -> str:
+    subcategory_map: dict[str, list[str]] = {}
+    for category in categories:
+        if category.name not in candidates:
+            continue
+        subs = list(
+            category.subcategories.order_by("name").values_list("name", flat=True)[:40]
+        )
+        if subs:
+            subcategory_map[category.name] = subs
+    return "\n".join(
+        f"- {name}: {', '.join(subs)}" for name, subs in subcategory_map.items()
+    )
+
+
+def _product_prompt_details(product: Product) -> list[str]:
     details = [
         f"Produit: {product.name}",
         f"SKU: {product.sku}",
@@ -942,26 +1105,27 @@ def _build_ai_prompt_with_subcategory(
         details.append(f"Categorie actuelle: {category}")
     if description := (product.description or "").strip():
         details.append(f"Description: {_truncate(description, 240)}")
+    return details
+
+
+def _build_ai_batch_prompt(
+    products: list[Product],
+    candidates: list[str],
+    categories: list[Category],
+) -> str:
+    product_blocks = [
+        f"[{index}] " + " | ".join(_product_prompt_details(product))
+        for index, product in enumerate(products, start=1)
+    ]
     category_block = "\n".join(f"- {name}" for name in candidates)
-    subcategory_map: dict[str, list[str]] = {}
-    for category in categories:
-        if category.name not in candidates:
-            continue
-        subs = list(
-            category.subcategories.order_by("name").values_list("name", flat=True)[:40]
-        )
-        if subs:
-            subcategory_map[category.name] = subs
-    subcategory_block = "\n".join(
-        f"- {name}: {', '.join(subs)}" for name, subs in subcategory_map.items()
-    )
+    subcategory_block = _build_subcategory_block(candidates, categories)
     return (
-        "Tu es un assistant qui choisit la meilleure categorie et sous-categorie pour un produit.\n"
+        "Tu es un assistant qui choisit la meilleure categorie et sous-categorie pour chaque produit.\n"
         "Tu peux reutiliser une categorie existante ou en proposer une nouvelle si rien ne convient.\n"
-        "Reponds uniquement en JSON sur une seule ligne: "
-        '{"category":"...","subcategory":"..."}. '
+        "Reponds uniquement avec un tableau JSON contenant une entree par produit: "
+        '[{"id":1,"category":"...","subcategory":"..."}, ...]. '
         "Si la sous-categorie n'est pas utile, mets null.\n\n"
-        + "\n".join(details)
+        + "\n".join(product_blocks)
         + "\n\nCategories disponibles:\n"
         + category_block
         + "\n\nSous-categories connues:\n"
@@ -969,6 +1133,35 @@ def _build_ai_prompt_with_subcategory(
     )
 
 
+def _parse_ai_batch_response(
+    response: str,
+    candidates: list[str],
+) -> dict[int, AICategorySuggestion | None] | None:
+    raw = response.strip()
+    if raw.startswith("```"):
+        raw = raw.strip("`").strip()
+    match = re.search(r"\[.*\]", raw, flags=re.DOTALL)
+    if not match:
+        return None
+    try:
+        payload = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(payload, list):
+        return None
+    normalized_map = {_normalize(name): name for name in candidates}
+    results: dict[int, AICategorySuggestion | None] = {}
+    for item in payload:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        results[index] = _suggestion_from_payload(item, normalized_map)
+    return results
+
+
 def _parse_ai_response_with_subcategory(
     response: str,
     candidates: list[str],
@@ -987,6 +1180,13 @@ def _parse_ai_response_with_subcategory(
         category_match = re.search(r'"category"\s*:\s*"([^"]+)"', raw, re.IGNORECASE)
         if category_match:
             payload = {"category": category_match.group(1)}
+    return _suggestion_from_payload(payload, normalized_map)
+
+
+def _suggestion_from_payload(
+    payload: object,
+    normalized_map: dict[str, str],
+) -> AICategorySuggestion | None:
     if not isinstance(payload, dict):
         return None
     category = str(payload.get("category") or "").strip()
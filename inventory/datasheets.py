@@ -1,19 +1,35 @@
 from __future__ import annotations
 
+import functools
 import hashlib
 import logging
 import re
+import tempfile
 import time
-from dataclasses import dataclass
-from typing import Iterable, Optional
-from urllib.parse import urljoin
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from itertools import islice
+from threading import Lock
+from io import BytesIO
+from typing import BinaryIO, Iterable, Optional
+from urllib.parse import urljoin, urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
+from django.core.files import File
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import QuerySet
 from django.utils import timezone
 
-from .models import Product
+from .models import Product, Version
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
@@ -24,45 +40,53 @@ _HYPHENS = {
     "\u2013": "-",
     "\u2212": "-",
 }
+_HYPHEN_TABLE = str.maketrans(_HYPHENS)
+
+_RE_NON_ALNUM = re.compile(r"[^A-Z0-9]+")
+_RE_DS_MODEL = re.compile(r"(DS-[A-Z0-9-]+)", re.IGNORECASE)
+_RE_TRAILING_DASH_NUM = re.compile(r"-\d+$", re.IGNORECASE)
+_RE_HREF_PDF = re.compile(r'href=["\']([^"\']+\.pdf[^"\']*)["\']', re.IGNORECASE)
+_RE_FILENAME_SAFE = re.compile(r"[^A-Za-z0-9._-]+")
+# Un seul balayage du texte d'un resultat donne tous les mots-cles utiles au score.
+_RE_SCORE_KEYWORDS = re.compile(r"datasheet|data sheet|fiche|firmware|manual")
+_POSITIVE_KEYWORDS = frozenset({"datasheet", "data sheet", "fiche"})
+
+_SPOOL_MAX_SIZE = 2 * 1024 * 1024
+_VERIFIED_CANDIDATES = 3
 
 _DEFAULT_CSE_ENDPOINT = "https://www.googleapis.com/customsearch/v1"
 _DEFAULT_SERPER_ENDPOINT = "https://google.serper.dev/search"
 
 
+@functools.lru_cache(maxsize=8192)
 def _normalize_model(value: str) -> str:
     if not value:
         return ""
-    for key, replacement in _HYPHENS.items():
-        value = value.replace(key, replacement)
-    value = value.upper().strip()
-    return re.sub(r"[^A-Z0-9]+", "", value)
+    value = value.translate(_HYPHEN_TABLE).upper().strip()
+    return _RE_NON_ALNUM.sub("", value)
 
 
 def _strip_unicode_hyphens(value: str) -> str:
     if not value:
         return ""
-    for key, replacement in _HYPHENS.items():
-        value = value.replace(key, replacement)
-    return value
+    return value.translate(_HYPHEN_TABLE)
 
 
 def extract_model(product: Product) -> str:
-    candidates = [
-        product.manufacturer_reference or "",
-        product.sku or "",
-        product.name or "",
-    ]
-    for raw in candidates:
+    first_nonempty = ""
+    for raw in (product.manufacturer_reference, product.sku, product.name):
+        if not raw:
+            continue
         cleaned = _strip_unicode_hyphens(raw)
-        match = re.search(r"(DS-[A-Z0-9-]+)", cleaned, re.IGNORECASE)
+        match = _RE_DS_MODEL.search(cleaned)
         if match:
             return match.group(1).strip()
-    base = next((value for value in candidates if value), "")
-    base = _strip_unicode_hyphens(base).strip()
-    base = re.sub(r"-\d+$", "", base, flags=re.IGNORECASE)
-    return base
+        if not first_nonempty:
+            first_nonempty = cleaned
+    return _RE_TRAILING_DASH_NUM.sub("", first_nonempty.strip())
 
 
+@functools.lru_cache(maxsize=4096)
 def build_query(model: str, prefer_lang: str = "fr", domain: str = "hikvision.com") -> str:
     if prefer_lang == "en":
         keywords = '(datasheet OR "data sheet")'
@@ -74,6 +98,7 @@ def build_query(model: str, prefer_lang: str = "fr", domain: str = "hikvision.co
     return query
 
 
+@functools.lru_cache(maxsize=64)
 def resolve_brand_datasheet_domain(brand_name: str) -> str:
     normalized = (brand_name or "").strip().lower()
     if normalized == "dahua":
@@ -98,6 +123,41 @@ def _get_serper_credentials() -> tuple[str, str]:
     return api_key or "", endpoint
 
 
+class HostRateLimiter:
+    """Space out calls to each host according to its allowed rate (QPS)."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._next_slot: dict[str, float] = {}
+
+    def acquire(self, host: str, qps: float) -> None:
+        if qps <= 0:
+            return
+        interval = 1.0 / qps
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + interval
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+_rate_limiter = HostRateLimiter()
+
+
+def _throttle(url: str, setting_name: str, default: float) -> None:
+    qps = float(getattr(settings, setting_name, default))
+    _rate_limiter.acquire(urlparse(url).netloc.lower(), qps)
+
+
+def _response_json(response: requests.Response) -> dict:
+    if orjson is not None:
+        # orjson lit directement les octets UTF-8 de la reponse.
+        return orjson.loads(response.content)
+    return response.json()
+
+
 def google_cse_search(
     session: requests.Session,
     query: str,
@@ -115,9 +175,10 @@ def google_cse_search(
         "fileType": "pdf",
         "fields": "items(link,title,snippet,mime)",
     }
+    _throttle(endpoint, "GOOGLE_CSE_QPS", 1.0)
     response = session.get(endpoint, params=params, timeout=30)
     response.raise_for_status()
-    return response.json()
+    return _response_json(response)
 
 
 def serper_search(
@@ -133,6 +194,7 @@ def serper_search(
         "q": query,
         "num": max(1, min(int(num or 10), 10)),
     }
+    _throttle(endpoint, "SERPER_QPS", 5.0)
     response = session.post(
         endpoint,
         json=payload,
@@ -140,7 +202,7 @@ def serper_search(
         headers={"X-API-KEY": api_key, "Content-Type": "application/json"},
     )
     response.raise_for_status()
-    return response.json()
+    return _response_json(response)
 
 
 def _serper_to_cse_items(data: dict) -> list[dict]:
@@ -163,12 +225,18 @@ def search_datasheet_pdf(
     *,
     prefer_lang: str = "fr",
     num: int = 10,
+    verify: bool = False,
 ) -> tuple[Optional[str], str]:
+    """Return the best PDF link for ``model`` and the search source used.
+
+    With ``verify`` the top candidates are probed with a HEAD request and
+    the first one actually served as a PDF is preferred.
+    """
     search_errors: list[str] = []
     try:
         serper_data = serper_search(session, query, num=num)
         serper_items = _serper_to_cse_items(serper_data)
-        best = pick_best_pdf(serper_items, model, prefer_lang=prefer_lang)
+        best = _pick_pdf_link(session, serper_items, model, prefer_lang=prefer_lang, verify=verify)
         if best:
             return best, "serper"
         search_errors.append("Serper: no PDF result found")
@@ -178,7 +246,7 @@ def search_datasheet_pdf(
     try:
         cse_data = google_cse_search(session, query, num=num)
         cse_items = cse_data.get("items") or []
-        best = pick_best_pdf(cse_items, model, prefer_lang=prefer_lang)
+        best = _pick_pdf_link(session, cse_items, model, prefer_lang=prefer_lang, verify=verify)
         if best:
             return best, "google_cse"
         search_errors.append("Google CSE: no PDF result found")
@@ -188,69 +256,156 @@ def search_datasheet_pdf(
     raise RuntimeError("; ".join(search_errors) or "No PDF result found.")
 
 
-def score_result(item: dict, model: str, prefer_lang: str = "fr") -> int:
-    url = (item.get("link") or "").lower()
-    title = (item.get("title") or "").lower()
-    snippet = (item.get("snippet") or "").lower()
-    blob = f"{url} {title} {snippet}"
+def score_result(item: dict, *, normalized_model: str, prefer_lang: str = "fr") -> int:
+    return _score(
+        *_lowered_fields(item),
+        normalized_model=normalized_model,
+        prefer_lang=prefer_lang,
+    )
+
+
+def _lowered_fields(item: dict) -> tuple[str, str, str, str]:
+    return (
+        (item.get("link") or "").lower(),
+        (item.get("title") or "").lower(),
+        (item.get("snippet") or "").lower(),
+        (item.get("mime") or "").lower(),
+    )
+
 
+def _score(
+    url: str,
+    title: str,
+    snippet: str,
+    mime: str,
+    *,
+    normalized_model: str,
+    prefer_lang: str,
+) -> int:
+    """Score an already lower-cased search result."""
     score = 0
     if url.endswith(".pdf") or ".pdf?" in url:
         score += 50
-    if (item.get("mime") or "").lower() == "application/pdf":
+    if mime == "application/pdf":
         score += 15
     if "hikvision.com" in url:
         score += 30
-    if "datasheet" in blob or "data sheet" in blob or "fiche" in blob:
+    keywords = set(_RE_SCORE_KEYWORDS.findall(f"{url} {title} {snippet}"))
+    if keywords & _POSITIVE_KEYWORDS:
         score += 20
 
-    normalized_model = _normalize_model(model)
-    if normalized_model and normalized_model in _normalize_model(url + title):
+    if normalized_model and (
+        normalized_model in _normalize_model(url) or normalized_model in _normalize_model(title)
+    ):
         score += 50
 
     if prefer_lang == "fr":
-        if "/fr/" in url or "fiche" in blob:
+        if "/fr/" in url or "fiche" in keywords:
             score += 10
     elif prefer_lang == "en":
-        if "/en/" in url or "datasheet" in blob:
+        if "/en/" in url or "datasheet" in keywords:
             score += 10
 
-    if "firmware" in blob:
+    if "firmware" in keywords:
         score -= 40
-    if "manual" in blob or "user manual" in blob:
+    if "manual" in keywords:
         score -= 20
 
     return score
 
 
+def rank_pdf_candidates(items: Iterable[dict], model: str, prefer_lang: str = "fr") -> list[str]:
+    normalized_model = _normalize_model(model)
+    scored = []
+    for index, item in enumerate(items):
+        link = item.get("link")
+        if not link:
+            continue
+        score = score_result(item, normalized_model=normalized_model, prefer_lang=prefer_lang)
+        scored.append((-score, index, link))
+    scored.sort()
+    return [link for _, _, link in scored]
+
+
 def pick_best_pdf(items: Iterable[dict], model: str, prefer_lang: str = "fr") -> Optional[str]:
-    best_url = None
-    best_score = -10**9
-    for item in items:
-        score = score_result(item, model, prefer_lang=prefer_lang)
-        if score > best_score:
-            best_score = score
-            best_url = item.get("link")
-    return best_url
+    ranked = rank_pdf_candidates(items, model, prefer_lang=prefer_lang)
+    return ranked[0] if ranked else None
+
+
+def _is_served_as_pdf(session: requests.Session, url: str) -> bool:
+    trusted_hosts = {
+        host.lower() for host in getattr(settings, "HIKVISION_DATASHEET_TRUSTED_HOSTS", None) or ()
+    }
+    if urlparse(url).netloc.lower() in trusted_hosts:
+        return True
+    _throttle(url, "PDF_DOWNLOAD_QPS", 2.0)
+    try:
+        response = session.head(url, timeout=10, allow_redirects=True)
+    except requests.RequestException:
+        return False
+    if response.status_code in (405, 501):
+        # Serveur qui refuse HEAD : le candidat est garde, le GET verifiera.
+        return True
+    if not response.ok:
+        return False
+    content_type = (response.headers.get("Content-Type") or "").lower()
+    if content_type.startswith("application/pdf"):
+        return True
+    return urlparse(response.url or url).path.lower().endswith(".pdf")
+
+
+def _pick_pdf_link(
+    session: requests.Session,
+    items: Iterable[dict],
+    model: str,
+    *,
+    prefer_lang: str,
+    verify: bool,
+) -> Optional[str]:
+    ranked = rank_pdf_candidates(items, model, prefer_lang=prefer_lang)
+    if not ranked:
+        return None
+    if verify:
+        # Un HEAD coute bien moins qu'un GET de 60 s suivi du repli HTML.
+        for url in ranked[:_VERIFIED_CANDIDATES]:
+            if _is_served_as_pdf(session, url):
+                return url
+    return ranked[0]
+
+
+def _html_link_priority(candidate: str) -> int:
+    score = 0
+    lower = candidate.lower()
+    if "datasheet" in lower or "data_sheet" in lower or "fiche" in lower:
+        score += 2
+    if "manual" in lower or "firmware" in lower:
+        score -= 1
+    return score
 
 
 def _extract_pdf_link_from_html(html: str, base_url: str) -> Optional[str]:
     if not html:
         return None
-    candidates = re.findall(r'href=["\']([^"\']+\.pdf[^"\']*)["\']', html, re.IGNORECASE)
-    if not candidates:
+    best_key = None
+    for match in _RE_HREF_PDF.finditer(html):
+        candidate = match.group(1)
+        key = (-_html_link_priority(candidate), candidate)
+        if best_key is None or key < best_key:
+            best_key = key
+    if best_key is None:
         return None
-    prioritized = []
-    for candidate in candidates:
-        score = 0
-        lower = candidate.lower()
-        if "datasheet" in lower or "data_sheet" in lower or "fiche" in lower:
-            score += 2
-        if "manual" in lower or "firmware" in lower:
-            score -= 1
-        prioritized.append((score, candidate))
-    prioritized.sort(key=lambda item: (-item[0], item[1]))
-    return urljoin(base_url, prioritized[0][1])
+    return urljoin(base_url, best_key[1])
+
+
+def _file_sha256(fileobj: BinaryIO) -> str:
+    file_digest = getattr(hashlib, "file_digest", None)
+    if file_digest is not None:
+        # Python >= 3.11 : lecture + hachage en C dans un tampon reutilise.
+        return file_digest(fileobj, "sha256").hexdigest()
+    hasher = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(256 * 1024), b""):
+        hasher.update(block)
+    return hasher.hexdigest()
 
 
 def download_pdf_streaming(
@@ -260,36 +415,61 @@ def download_pdf_streaming(
     max_mb: int = 20,
     html_limit_kb: int = 512,
     allow_html_fallback: bool = True,
-) -> tuple[str, bytes, str]:
+) -> tuple[str, BinaryIO, str]:
+    """Download ``url`` and return ``(final_url, file, sha256)``.
+
+    The returned file is positioned at the start and must be closed by the
+    caller. PDF bodies are spooled to disk past 2 MB so memory stays bounded.
+    """
     headers = {
         "User-Agent": "Mozilla/5.0 (compatible; DatasheetBot/1.0)",
     }
+    _throttle(url, "PDF_DOWNLOAD_QPS", 2.0)
     response = session.get(url, stream=True, timeout=60, allow_redirects=True, headers=headers)
     response.raise_for_status()
 
     content_type = (response.headers.get("Content-Type") or "").lower()
     is_html = "text/html" in content_type
-    byte_limit = (html_limit_kb * 1024) if is_html else (max_mb * 1024 * 1024)
 
-    chunks = []
-    hasher = hashlib.sha256()
-    total = 0
+    if not is_html:
+        byte_limit = max_mb * 1024 * 1024
+        spooled = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        try:
+            total = 0
+            for chunk in response.iter_content(chunk_size=256 * 1024):
+                if not chunk:
+                    continue
+                total += len(chunk)
+                if total > byte_limit:
+                    raise ValueError(f"PDF too large (> {max_mb} MB): {response.url}")
+                spooled.write(chunk)
+            spooled.seek(0)
+            if spooled.read(4) == b"%PDF":
+                spooled.seek(0)
+                sha256 = _file_sha256(spooled)
+                spooled.seek(0)
+                return response.url, spooled, sha256
+        except BaseException:
+            spooled.close()
+            raise
+        spooled.close()
+        raise ValueError(f"Downloaded file is not a PDF (content-type={content_type}) url={response.url}")
+
+    # Page HTML : seuls les premiers ``html_limit_kb`` sont utiles pour
+    # retrouver le lien vers le PDF.
+    byte_limit = html_limit_kb * 1024
+    content = bytearray()
     for chunk in response.iter_content(chunk_size=256 * 1024):
         if not chunk:
             continue
-        total += len(chunk)
-        if total > byte_limit:
-            if is_html:
-                break
-            raise ValueError(f"PDF too large (> {max_mb} MB): {response.url}")
-        hasher.update(chunk)
-        chunks.append(chunk)
+        if len(content) + len(chunk) > byte_limit:
+            break
+        content += chunk
 
-    content = b"".join(chunks)
     if content.startswith(b"%PDF"):
-        return response.url, content, hasher.hexdigest()
+        return response.url, BytesIO(content), hashlib.sha256(content).hexdigest()
 
-    if is_html and allow_html_fallback:
+    if allow_html_fallback:
         html = content.decode(errors="ignore")
         fallback_url = _extract_pdf_link_from_html(html, response.url)
         if fallback_url and fallback_url != url:
@@ -305,7 +485,7 @@ def download_pdf_streaming(
 
 
 def _safe_filename(model: str) -> str:
-    cleaned = re.sub(r"[^A-Za-z0-9._-]+", "_", model or "").strip("_")
+    cleaned = _RE_FILENAME_SAFE.sub("_", model or "").strip("_")
     if not cleaned:
         cleaned = "datasheet"
     return f"{cleaned}.pdf"
@@ -331,6 +511,35 @@ def _model_search_candidates(product: Product, fallback_model: str) -> list[str]
     return deduped
 
 
+def _build_session(workers: int = 1) -> requests.Session:
+    session = requests.Session()
+    session.headers.update(
+        {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+            "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+        }
+    )
+    # Serper, Google CSE et les hotes PDF sont appeles en boucle : on garde
+    # les connexions ouvertes et on reessaie les erreurs transitoires.
+    retries = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST", "HEAD"]),
+    )
+    # Un pool par hote (Serper, Google, sites constructeurs, CDN) : assez de
+    # pools pour ne pas evincer la connexion TLS de l'API de recherche, et
+    # assez de connexions par pool pour chaque thread de telechargement.
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=max(16, workers),
+        max_retries=retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 @dataclass
 class DatasheetSummary:
     products: int
@@ -341,6 +550,250 @@ class DatasheetSummary:
     errors: list[dict]
 
 
+@dataclass
+class _Download:
+    source: str
+    final_url: str
+    filename: str
+    content: Optional[BinaryIO] = None
+    sha256: str = ""
+
+    def close(self) -> None:
+        if self.content is not None and hasattr(self.content, "close"):
+            self.content.close()
+
+
+@dataclass
+class _BucketResult:
+    model: str
+    targets: list[Product]
+    download: Optional[_Download] = None
+    error: Optional[Exception] = None
+    fallbacks: dict[int, _Download] = field(default_factory=dict)
+
+
+class _UrlCache:
+    """Share one download per search-resolved URL between worker threads.
+
+    The first worker asking for a URL downloads it; the others wait for it
+    and get back the final URL and hash without the content, the stored
+    file being reused through its SHA-256. Only successful downloads stay
+    cached: after a failure the next worker downloads the URL again.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._futures: dict[str, Future] = {}
+
+    def fetch(self, url: str, download) -> tuple[str, Optional[BinaryIO], str]:
+        while True:
+            with self._lock:
+                future = self._futures.get(url)
+                owner = future is None
+                if owner:
+                    future = self._futures[url] = Future()
+            if owner:
+                break
+            try:
+                final_url, sha256 = future.result()
+            except Exception:  # noqa: BLE001
+                # Le telechargement partage a echoue : ce worker reessaie.
+                continue
+            return final_url, None, sha256
+        try:
+            final_url, content, sha256 = download()
+        except BaseException as exc:
+            with self._lock:
+                del self._futures[url]
+            future.set_exception(exc)
+            raise
+        future.set_result((final_url, sha256))
+        return final_url, content, sha256
+
+
+def _search_and_download(
+    session: requests.Session,
+    model: str,
+    *,
+    url_cache: _UrlCache,
+    search_domain: str,
+    prefer_lang: str,
+    dry_run: bool,
+    max_mb: int,
+    html_limit_kb: int,
+) -> _Download:
+    query = build_query(model, prefer_lang=prefer_lang, domain=search_domain)
+    best, source = search_datasheet_pdf(
+        session,
+        query,
+        model,
+        prefer_lang=prefer_lang,
+        num=10,
+        verify=not dry_run,
+    )
+    if dry_run:
+        return _Download(source=source, final_url=best, filename=_safe_filename(model))
+    final_url, content, sha256 = url_cache.fetch(
+        best,
+        lambda: download_pdf_streaming(
+            session,
+            best,
+            max_mb=max_mb,
+            html_limit_kb=html_limit_kb,
+        ),
+    )
+    return _Download(
+        source=source,
+        final_url=final_url,
+        filename=_safe_filename(model),
+        content=content,
+        sha256=sha256,
+    )
+
+
+def _fetch_bucket(
+    session: requests.Session,
+    model: str,
+    targets: list[Product],
+    **options,
+) -> _BucketResult:
+    """Search and download the datasheet of one model bucket.
+
+    Runs in a worker thread: only network calls happen here, the database
+    writes are left to the calling thread.
+    """
+    result = _BucketResult(model=model, targets=targets)
+    try:
+        result.download = _search_and_download(session, model, **options)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Datasheet fetch failed for %s: %s", model, exc)
+        result.error = exc
+        for product in targets:
+            for search_model in _model_search_candidates(product, model):
+                try:
+                    result.fallbacks[product.id] = _search_and_download(
+                        session, search_model, **options
+                    )
+                except Exception:  # noqa: BLE001
+                    continue
+                break
+    return result
+
+
+_DATASHEET_FIELDS = ["datasheet_pdf", "datasheet_url", "datasheet_fetched_at"]
+_BUCKET_FIELDS = ("id", "manufacturer_reference", "sku", "name", "datasheet_pdf", "datasheet_url")
+
+
+def _attach_download(
+    products: list[Product],
+    download: _Download,
+    stored_by_sha: dict[str, str],
+) -> bool:
+    """Point ``products`` at the stored file of ``download``.
+
+    Files already stored during the run are reused by SHA-256. Returns
+    ``False`` when the download was shared from another bucket whose file
+    is not stored yet.
+    """
+    stored_name = stored_by_sha.get(download.sha256) if download.sha256 else None
+    try:
+        if stored_name is None:
+            content = download.content
+            if content is None:
+                return False
+            if isinstance(content, (bytes, bytearray)):
+                django_file = ContentFile(content)
+            else:
+                django_file = File(content, name=download.filename)
+            # Ecriture unique dans le stockage : File laisse le backend lire
+            # le fichier temporaire par morceaux au lieu de tout recopier.
+            field = products[0].datasheet_pdf.field
+            stored_name = field.storage.save(
+                field.generate_filename(products[0], download.filename),
+                django_file,
+                max_length=field.max_length,
+            )
+            if download.sha256:
+                stored_by_sha[download.sha256] = stored_name
+    finally:
+        download.close()
+    fetched_at = timezone.now()
+    for product in products:
+        product.datasheet_pdf.name = stored_name
+        product.datasheet_url = download.final_url
+        product.datasheet_fetched_at = fetched_at
+    return True
+
+
+def _bulk_save_datasheets(products: list[Product]) -> None:
+    if not products:
+        return
+    with transaction.atomic():
+        Product.objects.bulk_update(products, _DATASHEET_FIELDS, batch_size=100)
+        if any(product.get_deferred_fields() for product in products):
+            # L'historique a besoin de la ligne complete.
+            products = list(Product.objects.filter(pk__in=[product.pk for product in products]))
+        Version.record_many(products, Version.Action.UPDATE)
+
+
+def _close_bucket_downloads(result: _BucketResult) -> None:
+    if result.download:
+        result.download.close()
+    for download in result.fallbacks.values():
+        download.close()
+
+
+def _store_bucket_result(
+    result: _BucketResult, stored_by_sha: dict[str, str], dry_run: bool
+) -> tuple[int, list[tuple[str, _Download, list[Product]]], list[Product]]:
+    """Store one bucket's downloads.
+
+    Returns the updated count, the downloads waiting for a file shared with
+    another bucket, and the products left without a datasheet.
+    """
+    model = result.model
+    deferred: list[tuple[str, _Download, list[Product]]] = []
+    if result.download:
+        download = result.download
+        if dry_run:
+            return len(result.targets), deferred, []
+        if not _attach_download(result.targets, download, stored_by_sha):
+            deferred.append((model, download, result.targets))
+            return 0, deferred, []
+        _bulk_save_datasheets(result.targets)
+        logger.info(
+            "Downloaded datasheet for %s via %s (sha256=%s)",
+            model,
+            download.source,
+            download.sha256,
+        )
+        return len(result.targets), deferred, []
+
+    remaining_products = []
+    downloaded = []
+    updated = 0
+    for product in result.targets:
+        download = result.fallbacks.get(product.id)
+        if not download:
+            remaining_products.append(product)
+            continue
+        if not dry_run:
+            if not _attach_download([product], download, stored_by_sha):
+                deferred.append((model, download, [product]))
+                continue
+            downloaded.append(product)
+            logger.info(
+                "Fallback datasheet download succeeded for %s (%s) via %s (sha256=%s)",
+                model,
+                product.sku,
+                download.source,
+                download.sha256,
+            )
+        updated += 1
+    _bulk_save_datasheets(downloaded)
+    return updated, deferred, remaining_products
+
+
 def fetch_hikvision_datasheets(
     *,
     queryset: Optional[Iterable[Product]] = None,
@@ -352,21 +805,21 @@ def fetch_hikvision_datasheets(
     domain: Optional[str] = None,
 ) -> DatasheetSummary:
     if queryset is None:
-        queryset = Product.objects.select_related("brand").filter(
-            brand__name__iexact=brand_name
-        )
-    if limit:
-        try:
-            queryset = list(queryset[:limit])
-        except TypeError:
-            queryset = list(queryset)
-            queryset = queryset[:limit]
+        queryset = Product.objects.filter(brand__name__iexact=brand_name)
+    if isinstance(queryset, QuerySet):
+        # Le regroupement n'a besoin que de quelques colonnes : on parcourt
+        # le curseur par paquets au lieu de charger tout le catalogue.
+        rows = queryset.select_related(None).only(*_BUCKET_FIELDS).iterator(chunk_size=1000)
     else:
-        queryset = list(queryset)
+        rows = iter(queryset)
+    if limit:
+        rows = islice(rows, limit)
 
+    product_count = 0
     buckets: dict[str, list[Product]] = {}
     errors: list[dict] = []
-    for product in queryset:
+    for product in rows:
+        product_count += 1
         model = extract_model(product)
         if not model:
             errors.append(
@@ -378,139 +831,108 @@ def fetch_hikvision_datasheets(
     updated = 0
     skipped = 0
     failed = 0
-    session = requests.Session()
-    session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
-        }
-    )
     max_mb = int(getattr(settings, "HIKVISION_DATASHEET_MAX_MB", 20))
     html_limit_kb = int(getattr(settings, "HIKVISION_DATASHEET_HTML_LIMIT_KB", 512))
-    sleep_s = float(getattr(settings, "HIKVISION_DATASHEET_SLEEP", 1.0))
+    workers = max(1, int(getattr(settings, "HIKVISION_DATASHEET_WORKERS", 4)))
+    session = _build_session(workers)
 
     search_domain = domain or resolve_brand_datasheet_domain(brand_name)
 
+    pending: list[tuple[str, list[Product]]] = []
     for model, products in buckets.items():
-        existing_pdf = next((p.datasheet_pdf for p in products if p.datasheet_pdf), None)
-        existing_url = next((p.datasheet_url for p in products if p.datasheet_url), None)
-        if existing_pdf and not force:
-            for product in products:
-                if product.datasheet_pdf:
-                    skipped += 1
-                    continue
-                if not dry_run:
-                    product.datasheet_pdf.name = existing_pdf.name
-                    if existing_url and not product.datasheet_url:
-                        product.datasheet_url = existing_url
-                    product.datasheet_fetched_at = timezone.now()
-                    product.save(update_fields=["datasheet_pdf", "datasheet_url", "datasheet_fetched_at"])
-                updated += 1
-            continue
-        if not force and all(product.datasheet_pdf for product in products):
-            skipped += len(products)
-            continue
-
-        targets = [product for product in products if force or not product.datasheet_pdf]
-        if not targets:
-            skipped += len(products)
-            continue
-
-        query = build_query(model, prefer_lang=prefer_lang, domain=search_domain)
-        try:
-            best, source = search_datasheet_pdf(
-                session,
-                query,
-                model,
-                prefer_lang=prefer_lang,
-                num=10,
-            )
-
+        have_pdf: list[Product] = []
+        need_pdf: list[Product] = []
+        for product in products:
+            (have_pdf if product.datasheet_pdf else need_pdf).append(product)
+        if have_pdf and not force:
+            # Un produit du lot a deja la fiche : on la partage sans recherche.
+            skipped += len(have_pdf)
+            if not need_pdf:
+                continue
+            updated += len(need_pdf)
             if dry_run:
-                updated += len(targets)
                 continue
-
-            final_url, content, sha256 = download_pdf_streaming(
-                session,
-                best,
-                max_mb=max_mb,
-                html_limit_kb=html_limit_kb,
-            )
-            filename = _safe_filename(model)
-
-            stored_name = None
-            for product in targets:
-                if stored_name:
-                    product.datasheet_pdf.name = stored_name
-                else:
-                    product.datasheet_pdf.save(filename, ContentFile(content), save=False)
-                    stored_name = product.datasheet_pdf.name
-                product.datasheet_url = final_url
-                product.datasheet_fetched_at = timezone.now()
-                product.save(update_fields=["datasheet_url", "datasheet_pdf", "datasheet_fetched_at"])
-                updated += 1
-            logger.info("Downloaded datasheet for %s via %s (sha256=%s)", model, source, sha256)
-        except Exception as exc:  # noqa: BLE001
-            logger.warning("Datasheet fetch failed for %s: %s", model, exc)
-            remaining_products = list(targets)
-            for product in targets:
-                product_downloaded = False
-                for search_model in _model_search_candidates(product, model):
-                    fallback_query = build_query(search_model, prefer_lang=prefer_lang, domain=search_domain)
-                    try:
-                        best, source = search_datasheet_pdf(
-                            session,
-                            fallback_query,
-                            search_model,
-                            prefer_lang=prefer_lang,
-                            num=10,
-                        )
-                        if dry_run:
-                            updated += 1
-                            product_downloaded = True
-                            break
-                        final_url, content, sha256 = download_pdf_streaming(
-                            session,
-                            best,
-                            max_mb=max_mb,
-                            html_limit_kb=html_limit_kb,
-                        )
-                        filename = _safe_filename(search_model)
-                        product.datasheet_pdf.save(filename, ContentFile(content), save=False)
-                        product.datasheet_url = final_url
-                        product.datasheet_fetched_at = timezone.now()
-                        product.save(update_fields=["datasheet_url", "datasheet_pdf", "datasheet_fetched_at"])
-                        updated += 1
-                        product_downloaded = True
-                        logger.info(
-                            "Fallback datasheet download succeeded for %s (%s) via %s (sha256=%s)",
-                            model,
-                            product.sku,
-                            source,
-                            sha256,
-                        )
-                        break
-                    except Exception:  # noqa: BLE001
-                        continue
-
-                if product_downloaded:
-                    remaining_products.remove(product)
-
+            existing_name = have_pdf[0].datasheet_pdf.name
+            existing_url = next((p.datasheet_url for p in products if p.datasheet_url), None)
+            fetched_at = timezone.now()
+            for product in need_pdf:
+                product.datasheet_pdf.name = existing_name
+                if existing_url and not product.datasheet_url:
+                    product.datasheet_url = existing_url
+                product.datasheet_fetched_at = fetched_at
+            _bulk_save_datasheets(need_pdf)
+            continue
+        pending.append((model, products if force else need_pdf))
+
+    options = {
+        "url_cache": _UrlCache(),
+        "search_domain": search_domain,
+        "prefer_lang": prefer_lang,
+        "dry_run": dry_run,
+        "max_mb": max_mb,
+        "html_limit_kb": html_limit_kb,
+    }
+    stored_by_sha: dict[str, str] = {}
+    deferred: list[tuple[str, _Download, list[Product]]] = []
+    # Les recherches et telechargements sont limites par la latence reseau :
+    # on les parallelise, les ecritures en base restent dans ce thread.
+    with ThreadPoolExecutor(max_workers=min(workers, len(pending) or 1)) as executor:
+        futures = {
+            executor.submit(_fetch_bucket, session, model, targets, **options): (model, targets)
+            for model, targets in pending
+        }
+        for future in as_completed(futures):
+            model, targets = futures[future]
+            result = None
+            try:
+                result = future.result()
+                bucket_updated, bucket_deferred, remaining_products = _store_bucket_result(
+                    result, stored_by_sha, dry_run
+                )
+            except Exception as exc:  # noqa: BLE001
+                # Une erreur de stockage ou de base n'arrete pas les autres lots.
+                logger.exception("Storing datasheet failed for %s", model)
+                if result is not None:
+                    _close_bucket_downloads(result)
+                failed += len(targets)
+                errors.append(
+                    {"model": model, "error": str(exc), "products": [product.id for product in targets]}
+                )
+                continue
+            updated += bucket_updated
+            deferred.extend(bucket_deferred)
             if remaining_products:
                 failed += len(remaining_products)
                 errors.append(
                     {
                         "model": model,
-                        "error": str(exc),
+                        "error": str(result.error),
                         "products": [product.id for product in remaining_products],
                     }
                 )
-        finally:
-            if sleep_s:
-                time.sleep(sleep_s)
+
+    # Telechargements partages avec un autre lot : le fichier est desormais stocke.
+    for model, download, products in deferred:
+        try:
+            if _attach_download(products, download, stored_by_sha):
+                _bulk_save_datasheets(products)
+                updated += len(products)
+                continue
+            error = f"Shared datasheet download was not stored: {download.final_url}"
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Storing shared datasheet failed for %s", model)
+            error = str(exc)
+        failed += len(products)
+        errors.append(
+            {
+                "model": model,
+                "error": error,
+                "products": [product.id for product in products],
+            }
+        )
 
     return DatasheetSummary(
-        products=len(queryset),
+        products=product_count,
         models=len(buckets),
         updated=updated,
         skipped=skipped,
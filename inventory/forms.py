@@ -1,6 +1,10 @@
 ﻿from decimal import Decimal
 
 from django import forms
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
 from .models import (
@@ -15,12 +19,185 @@ from .models import (
     generate_customer_reference,
 )
 
+_ZERO = Decimal("0.00")
+
+
 def _manual_movement_queryset():
     # Allow any movement type to be selected for manual entries to avoid
     # rejecting newly added codes during data setup or tests.
     return MovementType.objects.order_by("name")
 
 
+# Colonnes utiles a une ligne de vente scannee : inutile de charger les
+# descriptions et fiches techniques.
+SCAN_PRODUCT_FIELDS = ("id", "sku", "barcode", "name", "sale_price")
+
+def _now_local_isoformat():
+    # Valeur initiale des champs datetime-local, a l'heure du fuseau actif.
+    now = timezone.localtime()
+    return f"{now.year:04d}-{now.month:02d}-{now.day:02d}T{now.hour:02d}:{now.minute:02d}"
+
+
+_SITES_CACHE_KEY = "inv:sites:v1"
+_MOVEMENT_TYPES_CACHE_KEY = "inv:movement_types:v1"
+_CUSTOMERS_CACHE_KEY = "inv:customers:v1"
+_REFERENCE_CACHE_TIMEOUT = 300
+
+
+def _cached_sites():
+    return cache.get_or_set(
+        _SITES_CACHE_KEY, lambda: list(Site.objects.order_by("name")), _REFERENCE_CACHE_TIMEOUT
+    )
+
+
+def _cached_sites_by_id():
+    return {site.pk: site for site in _cached_sites()}
+
+
+def _cached_movement_types():
+    return cache.get_or_set(
+        _MOVEMENT_TYPES_CACHE_KEY,
+        lambda: list(_manual_movement_queryset()),
+        _REFERENCE_CACHE_TIMEOUT,
+    )
+
+
+def _cached_customers():
+    # Seules les colonnes lues par display_name.
+    return cache.get_or_set(
+        _CUSTOMERS_CACHE_KEY,
+        lambda: list(
+            Customer.objects.order_by("name", "company_name").only(
+                "id", "reference", "name", "company_name"
+            )
+        ),
+        _REFERENCE_CACHE_TIMEOUT,
+    )
+
+
+def _cached_entry_movement_types():
+    return [
+        movement_type
+        for movement_type in _cached_movement_types()
+        if movement_type.direction == MovementType.MovementDirection.ENTRY
+    ]
+
+
+def _assigned_site(user):
+    """Site of ``user``'s assignment, resolved once per user instance."""
+    if not hasattr(user, "_assigned_site"):
+        assignment = getattr(user, "site_assignment", None)
+        if assignment is None:
+            user._assigned_site = None
+        else:
+            # Le site est repris du cache des sites : pas de requete dediee.
+            site = _cached_sites_by_id().get(assignment.site_id)
+            user._assigned_site = site if site is not None else assignment.site
+    return user._assigned_site
+
+
+def _movement_site_scope(user):
+    """Sites ``user`` may pick for a movement, or ``None`` when unrestricted.
+
+    Resolved once per user instance: every movement form of the request
+    reuses it.
+    """
+    if not user or getattr(user, "is_superuser", False):
+        return None
+    if not hasattr(user, "_movement_site_scope"):
+        assigned_site = _assigned_site(user)
+        user._movement_site_scope = [assigned_site] if assigned_site else []
+    return user._movement_site_scope
+
+
+def _apply_site_scope(field, user):
+    """Restrict ``field`` to the sites of ``user``; return the allowed sites."""
+    scope = _movement_site_scope(user)
+    if scope is None:
+        sites = _cached_sites()
+        field.queryset = Site.objects.order_by("name")
+    else:
+        sites = scope
+        field.queryset = Site.objects.filter(pk__in=[site.pk for site in sites])
+    _set_cached_choices(field, sites)
+    return sites
+
+
+def _set_cached_choices(field, objects):
+    # Les options sont rendues depuis le cache, qui est local au processus et
+    # peut etre en retard : la valeur soumise est toujours validee par le
+    # queryset du champ.
+    choices = [(obj.pk, str(obj)) for obj in objects]
+    if field.empty_label is not None:
+        choices.insert(0, ("", field.empty_label))
+    field.choices = choices
+
+
+@receiver([post_save, post_delete], sender=Site, dispatch_uid="inventory_forms_sites_cache")
+def _invalidate_sites_cache(**kwargs):
+    cache.delete(_SITES_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender=Customer, dispatch_uid="inventory_forms_customers_cache")
+def _invalidate_customers_cache(**kwargs):
+    cache.delete(_CUSTOMERS_CACHE_KEY)
+
+
+@receiver(
+    [post_save, post_delete],
+    sender=MovementType,
+    dispatch_uid="inventory_forms_movement_types_cache",
+)
+def _invalidate_movement_types_cache(**kwargs):
+    cache.delete(_MOVEMENT_TYPES_CACHE_KEY)
+
+
+class ProductAutocompleteWidget(forms.Select):
+    """Select rendering only the chosen product.
+
+    The other options are picked client side from the product dataset,
+    which adds the missing ``<option>``, so the catalogue is never listed.
+    """
+
+    def __init__(self, attrs=None):
+        super().__init__(attrs)
+        # Produits deja charges (par le formset), indexes par pk en texte.
+        self.known_products = {}
+
+    def optgroups(self, name, value, attrs=None):
+        pks = [item for item in value if item and str(item).isdigit()]
+        options = [("", "---------")]
+        known = [self.known_products[pk] for pk in pks if pk in self.known_products]
+        missing = [pk for pk in pks if pk not in self.known_products]
+        if missing:
+            known.extend(Product.objects.filter(pk__in=missing).only("id", "sku", "name"))
+        options.extend((product.pk, str(product)) for product in known)
+        groups = []
+        for index, (option_value, label) in enumerate(options):
+            selected = str(option_value) in value
+            option = self.create_option(name, option_value, label, selected, index, attrs=attrs)
+            groups.append((None, [option], index))
+        return groups
+
+
+class PreloadedModelChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField resolving PKs from objects loaded beforehand.
+
+    ``known_objects`` maps the PK as text to instances freshly loaded for
+    this request (formset-wide product lookup); unknown PKs fall back to
+    the queryset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.known_objects = {}
+
+    def to_python(self, value):
+        if value not in self.empty_values and str(value) in self.known_objects:
+            return self.known_objects[str(value)]
+        return super().to_python(value)
+
+
 class StockMovementForm(forms.ModelForm):
     movement_type = forms.ModelChoiceField(
         queryset=_manual_movement_queryset(),
@@ -49,7 +226,7 @@ class StockMovementForm(forms.ModelForm):
             "comment",
         ]
         widgets = {
-            "product": forms.Select(attrs={"class": "form-control product-select"}),
+            "product": ProductAutocompleteWidget(attrs={"class": "form-control product-select"}),
             "quantity": forms.NumberInput(attrs={"class": "form-control", "min": 1, "step": 1}),
             "site": forms.Select(attrs={"class": "form-control"}),
             "document_number": forms.TextInput(attrs={"class": "form-control"}),
@@ -68,18 +245,14 @@ class StockMovementForm(forms.ModelForm):
         self._current_site = current_site
         self._site_locked = bool(site_locked and current_site)
         super().__init__(*args, **kwargs)
+        _set_cached_choices(self.fields["movement_type"], _cached_movement_types())
         if not self.data.get("movement_date") and not self.initial.get("movement_date"):
-            self.fields["movement_date"].initial = timezone.now().strftime("%Y-%m-%dT%H:%M")
+            self.fields["movement_date"].initial = _now_local_isoformat()
         if current_site:
             self.fields["site"].initial = current_site
         if self._site_locked:
             self.fields["site"].widget = forms.HiddenInput()
-        if user and not getattr(user, "is_superuser", False):
-            assignment = getattr(user, "site_assignment", None)
-            if assignment:
-                self.fields["site"].queryset = Site.objects.filter(pk=assignment.site_id)
-            else:
-                self.fields["site"].queryset = Site.objects.none()
+        _apply_site_scope(self.fields["site"], user)
 
     def clean_quantity(self):
         quantity = self.cleaned_data["quantity"]
@@ -129,8 +302,9 @@ class MovementHeaderForm(forms.Form):
         self._site_locked = bool(site_locked and current_site)
         self._user = user
         super().__init__(*args, **kwargs)
+        _set_cached_choices(self.fields["movement_type"], _cached_movement_types())
         if not self.data.get("movement_date") and not self.initial.get("movement_date"):
-            self.fields["movement_date"].initial = timezone.now().strftime("%Y-%m-%dT%H:%M")
+            self.fields["movement_date"].initial = _now_local_isoformat()
         if current_site:
             self.fields["site"].initial = current_site
         self._limit_sites()
@@ -138,15 +312,16 @@ class MovementHeaderForm(forms.Form):
             self.fields["site"].widget = forms.HiddenInput()
 
     def _limit_sites(self):
-        if not self._user or getattr(self._user, "is_superuser", False):
-            self.fields["site"].queryset = Site.objects.order_by("name")
+        sites = _apply_site_scope(self.fields["site"], self._user)
+        if _movement_site_scope(self._user) is None:
+            # Compte sans restriction : le queryset du champ suffit, le cache
+            # des sites peut ignorer un site cree par un autre processus.
+            self._allowed_site_ids = None
             return
-        assignment = getattr(self._user, "site_assignment", None)
-        if assignment:
-            self.fields["site"].queryset = Site.objects.filter(pk=assignment.site_id)
-            self.fields["site"].initial = assignment.site
-        else:
-            self.fields["site"].queryset = Site.objects.none()
+        self._allowed_site_ids = {site.pk for site in sites}
+        if sites:
+            # Compte rattache a un site : il est preselectionne.
+            self.fields["site"].initial = sites[0]
 
     def clean_site(self):
         site = self.cleaned_data.get("site")
@@ -154,16 +329,16 @@ class MovementHeaderForm(forms.Form):
             raise forms.ValidationError("Le site ne peut pas être modifié.")
         if site is None:
             raise forms.ValidationError("Sélectionnez un site accessible.")
-        if site not in self.fields["site"].queryset:
+        if self._allowed_site_ids is not None and site.pk not in self._allowed_site_ids:
             raise forms.ValidationError("Ce site n'est pas autorisé pour votre compte.")
         return site
 
 
 class MovementLineForm(forms.Form):
     product = forms.ModelChoiceField(
-        queryset=Product.objects.order_by("name"),
+        queryset=Product.objects.all(),
         label="Produit",
-        widget=forms.Select(attrs={"class": "form-control product-select"}),
+        widget=ProductAutocompleteWidget(attrs={"class": "form-control product-select"}),
     )
     quantity = forms.IntegerField(
         min_value=1,
@@ -180,7 +355,7 @@ class MovementLineForm(forms.Form):
 
 class InventoryAdjustmentForm(forms.Form):
     product = forms.ModelChoiceField(
-        queryset=Product.objects.all(),
+        queryset=Product.objects.only("id", "sku", "name"),
         label="Produit",
         widget=forms.Select(attrs={"class": "form-control"}),
     )
@@ -206,6 +381,7 @@ class InventoryAdjustmentForm(forms.Form):
         self._current_site = current_site
         self._site_locked = bool(site_locked and current_site)
         super().__init__(*args, **kwargs)
+        _set_cached_choices(self.fields["site"], _cached_sites())
         if current_site:
             self.fields["site"].initial = current_site
         if self._site_locked:
@@ -296,6 +472,8 @@ class CSVImportForm(forms.Form):
         self._current_site = current_site
         self._site_locked = bool(site_locked and current_site)
         super().__init__(*args, **kwargs)
+        _set_cached_choices(self.fields["movement_type"], _cached_entry_movement_types())
+        _set_cached_choices(self.fields["site"], _cached_sites())
         if current_site:
             self.fields["site"].initial = current_site
         if self._site_locked:
@@ -310,17 +488,20 @@ class CSVImportForm(forms.Form):
         return site
 
 
+ASSET_CHOICES = (
+    ("description", "Descriptions"),
+    ("images", "Images"),
+    ("techsheet", "Fiche technique"),
+    ("pdf", "Brochures PDF"),
+    ("videos", "Vidéos"),
+    ("blog", "Blog"),
+)
+
+
 class ProductAssetBotForm(forms.Form):
-    ASSET_CHOICES = (
-        ("description", "Descriptions"),
-        ("images", "Images"),
-        ("techsheet", "Fiche technique"),
-        ("pdf", "Brochures PDF"),
-        ("videos", "Vidéos"),
-        ("blog", "Blog"),
-    )
+    ASSET_CHOICES = ASSET_CHOICES
     product = forms.ModelChoiceField(
-        queryset=Product.objects.order_by("name"),
+        queryset=Product.objects.only("id", "sku", "name").order_by("name"),
         label="Produit ciblé",
         widget=forms.Select(attrs={"class": "form-control"}),
     )
@@ -357,7 +538,7 @@ class ProductAssetBotForm(forms.Form):
 
 
 class ProductAssetBotBulkForm(forms.Form):
-    ASSET_CHOICES = ProductAssetBotForm.ASSET_CHOICES
+    ASSET_CHOICES = ASSET_CHOICES
     limit = forms.IntegerField(
         required=False,
         min_value=1,
@@ -399,7 +580,7 @@ class ProductAssetBotBulkForm(forms.Form):
 
 
 class ProductAssetBotSelectionForm(forms.Form):
-    ASSET_CHOICES = ProductAssetBotForm.ASSET_CHOICES
+    ASSET_CHOICES = ASSET_CHOICES
     query = forms.CharField(
         required=False,
         label="Recherche",
@@ -460,7 +641,12 @@ class ProductAssetBotSelectionForm(forms.Form):
 
     def __init__(self, *args, queryset=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields["products"].queryset = queryset if queryset is not None else Product.objects.none()
+        if queryset is None:
+            queryset = Product.objects.none()
+        else:
+            # Une case par produit : seules les colonnes du libelle sont utiles.
+            queryset = queryset.only("id", "sku", "name", "barcode")
+        self.fields["products"].queryset = queryset
 
 
 class HikvisionDatasheetForm(forms.Form):
@@ -574,13 +760,14 @@ class SaleForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         self.fields["customer"].queryset = Customer.objects.order_by("name", "company_name")
         self.fields["customer"].empty_label = "— Aucun client —"
+        _set_cached_choices(self.fields["customer"], _cached_customers())
         if not self.data.get("sale_date") and not self.initial.get("sale_date"):
-            self.fields["sale_date"].initial = timezone.now().strftime("%Y-%m-%dT%H:%M")
+            self.fields["sale_date"].initial = _now_local_isoformat()
 
     def clean_amount_paid(self):
         amount = self.cleaned_data.get("amount_paid")
         if amount is None:
-            return Decimal("0.00")
+            return _ZERO
         return amount
 
     def clean(self):
@@ -596,16 +783,22 @@ class SaleForm(forms.ModelForm):
 
 
 class SaleItemForm(forms.Form):
+    """Sale line form.
+
+    When editing, build ``initial`` from ``Sale.items_for_edit_form()`` so the
+    products come with their lines instead of one query per line.
+    """
+
     line_type = forms.ChoiceField(
         choices=SaleItem.LineType.choices,
         initial=SaleItem.LineType.PRODUCT,
         widget=forms.HiddenInput(attrs={"class": "line-type-input"}),
     )
-    product = forms.ModelChoiceField(
+    product = PreloadedModelChoiceField(
         queryset=Product.objects.all(),
         label="Produit",
         required=False,
-        widget=forms.Select(attrs={"class": "form-control product-select"}),
+        widget=ProductAutocompleteWidget(attrs={"class": "form-control product-select"}),
     )
     quantity = forms.IntegerField(
         min_value=0,
@@ -637,9 +830,12 @@ class SaleItemForm(forms.Form):
         ),
     )
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, products=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields["product"].required = False
+        if products:
+            self.fields["product"].known_objects = products
+            self.fields["product"].widget.known_products = products
 
     def clean(self):
         cleaned_data = super().clean()
@@ -648,14 +844,9 @@ class SaleItemForm(forms.Form):
         scan_code = (cleaned_data.get("scan_code") or "").strip()
         cleaned_data["scan_code"] = scan_code
         if line_type == SaleItem.LineType.PRODUCT:
-            product = cleaned_data.get("product")
-            if not product and scan_code:
-                product_match = Product.objects.for_scan_code(scan_code).first()
-                if not product_match:
-                    raise forms.ValidationError(f"Aucun produit ne correspond au code {scan_code}.")
-                cleaned_data["product"] = product_match
-                self.cleaned_data["product"] = product_match
-            if not cleaned_data.get("product"):
+            # Un code scanne sans produit est resolu par le formset, en une
+            # seule requete pour toutes les lignes.
+            if not cleaned_data.get("product") and not scan_code:
                 raise forms.ValidationError("Choisissez un produit ou scannez un code QR valide.")
             quantity = cleaned_data.get("quantity")
             if quantity is None or quantity <= 0:
@@ -668,7 +859,7 @@ class SaleItemForm(forms.Form):
             cleaned_data["product"] = None
             cleaned_data["scan_code"] = ""
             cleaned_data["quantity"] = 0
-            cleaned_data["unit_price"] = Decimal("0.00")
+            cleaned_data["unit_price"] = _ZERO
         return cleaned_data
 
 
@@ -746,11 +937,13 @@ class CustomerForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        if not self.instance.pk and not self.data.get("reference") and not self.initial.get("reference"):
+        # Un formulaire lie ignore la valeur initiale : clean_reference genere
+        # la reference si elle manque.
+        if not self.is_bound and not self.instance.pk and not self.initial.get("reference"):
             self.fields["reference"].initial = generate_customer_reference()
 
     def clean_credit_limit(self):
-        credit_limit = self.cleaned_data.get("credit_limit") or Decimal("0.00")
+        credit_limit = self.cleaned_data.get("credit_limit") or _ZERO
         if credit_limit < 0:
             raise forms.ValidationError("Le plafond ne peut pas être négatif.")
         return credit_limit
@@ -787,28 +980,120 @@ class CustomerAccountEntryForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if not self.data.get("occurred_at") and not self.initial.get("occurred_at"):
-            self.fields["occurred_at"].initial = timezone.now().strftime("%Y-%m-%dT%H:%M")
+            self.fields["occurred_at"].initial = _now_local_isoformat()
 
     def clean_amount(self):
-        amount = self.cleaned_data.get("amount") or Decimal("0.00")
+        amount = self.cleaned_data.get("amount") or _ZERO
         if amount <= 0:
             raise forms.ValidationError("Indiquez un montant positif.")
         return amount
 
 
+def _products_by_scan_code(codes):
+    """Map each scan code (upper-cased) to its product, in one query."""
+    if not codes:
+        return {}
+    lookup = Q()
+    for code in codes:
+        lookup |= Q(barcode__iexact=code) | Q(sku__iexact=code) | Q(manufacturer_reference__iexact=code)
+    wanted = {code.upper() for code in codes}
+    matches = {}
+    # Meme priorite que for_scan_code(...).first() : le premier produit par nom.
+    for product in Product.objects.filter(lookup).only(*SCAN_PRODUCT_FIELDS, "manufacturer_reference"):
+        for value in (product.barcode, product.sku, product.manufacturer_reference):
+            key = (value or "").upper()
+            if key in wanted:
+                matches.setdefault(key, product)
+    return matches
+
+
 class BaseSaleItemFormSet(forms.BaseFormSet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._products = self._load_products()
+
+    def _load_products(self):
+        # Une requete pour tous les produits des lignes, au lieu d'un
+        # queryset.get() par formulaire.
+        products = {}
+        pks = set()
+        if self.is_bound:
+            prefix = f"{self.prefix}-"
+            for key, value in self.data.items():
+                if key.startswith(prefix) and key.endswith("-product") and str(value).isdigit():
+                    pks.add(int(value))
+        for row in self.initial or []:
+            product = row.get("product")
+            if isinstance(product, Product):
+                products[str(product.pk)] = product
+            elif product and str(product).isdigit():
+                pks.add(int(product))
+        pks -= {int(pk) for pk in products}
+        if pks:
+            for product in Product.objects.filter(pk__in=pks).only(*SCAN_PRODUCT_FIELDS):
+                products[str(product.pk)] = product
+        return products
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs["products"] = self._products
+        return kwargs
+
     def clean(self):
         super().clean()
+        self._resolve_scan_codes()
         if any(self.errors):
             return
-        product_lines = 0
+        has_product_line = any(
+            form.cleaned_data
+            and not form.cleaned_data.get("DELETE")
+            and form.cleaned_data.get("line_type") == SaleItem.LineType.PRODUCT
+            for form in self.forms
+        )
+        if not has_product_line:
+            raise forms.ValidationError("Ajoutez au moins un produit a la vente.")
+
+    def _resolve_scan_codes(self):
+        pending = [
+            form
+            for form in self.forms
+            if getattr(form, "cleaned_data", None)
+            and not form.cleaned_data.get("DELETE")
+            and form.cleaned_data.get("line_type") == SaleItem.LineType.PRODUCT
+            and not form.cleaned_data.get("product")
+            and form.cleaned_data.get("scan_code")
+        ]
+        if not pending:
+            return
+        products = _products_by_scan_code({form.cleaned_data["scan_code"] for form in pending})
+        for form in pending:
+            scan_code = form.cleaned_data["scan_code"]
+            product = products.get(scan_code.upper())
+            if product is None:
+                form.add_error(None, f"Aucun produit ne correspond au code {scan_code}.")
+                continue
+            form.cleaned_data["product"] = product
+
+
+class BaseSaleLineFormSet(forms.BaseFormSet):
+    """Formset over existing sale lines (returns, adjustments).
+
+    ``sale_items`` are the lines the forms may target, loaded once by the
+    view. Each valid form gets its line as ``form.sale_item``.
+    """
+
+    def __init__(self, *args, sale_items=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sale_items = {item.pk: item for item in sale_items}
+
+    def clean(self):
+        super().clean()
         for form in self.forms:
-            if not form.cleaned_data or form.cleaned_data.get("DELETE"):
+            if not getattr(form, "cleaned_data", None):
                 continue
-            if form.cleaned_data.get("line_type") == SaleItem.LineType.PRODUCT:
-                product_lines += 1
-        if product_lines == 0:
-            raise forms.ValidationError("Ajoutez au moins un produit a la vente.")
+            form.sale_item = self.sale_items.get(form.cleaned_data.get("sale_item_id"))
+            if form.sale_item is None:
+                form.add_error(None, "Ligne invalide.")
 
 
 SaleItemFormSet = forms.formset_factory(
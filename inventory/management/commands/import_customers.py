@@ -4,9 +4,11 @@ import unicodedata
 from pathlib import Path
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import Q
+from django.db import transaction
+from django.utils import timezone
 
-from inventory.models import Customer, generate_customer_reference
+from inventory.forms import _invalidate_customers_cache
+from inventory.models import Customer, Version, generate_customer_reference
 
 try:  # pragma: no cover
     from openpyxl import load_workbook
@@ -22,6 +24,9 @@ ACTIVITY_HEADERS = ("activite", "activites", "activity")
 CITY_HEADERS = ("ville", "city")
 COUNTRY_HEADERS = ("pays", "country")
 
+BATCH_SIZE = 500
+UPDATE_FIELDS = ["phone", "email", "address", "notes", "updated_at"]
+
 
 def _normalize_header(value: object | None) -> str:
     if value is None:
@@ -32,13 +37,15 @@ def _normalize_header(value: object | None) -> str:
 
 
 def _clean_text(value: object | None) -> str:
-    if value is None:
+    if value is None or value == "":
         return ""
-    return " ".join(str(value).split())
+    text = str(value)
+    if text.isspace():
+        return ""
+    return " ".join(text.split())
 
 
-def _select_column(headers: tuple[object, ...], candidates: tuple[str, ...]) -> int | None:
-    normalized_headers = [_normalize_header(header) for header in headers]
+def _select_column(normalized_headers: list[str], candidates: tuple[str, ...]) -> int | None:
     for candidate in candidates:
         for idx, header in enumerate(normalized_headers):
             if candidate in header:
@@ -46,21 +53,64 @@ def _select_column(headers: tuple[object, ...], candidates: tuple[str, ...]) ->
     return None
 
 
-def _pick_value(row: tuple[object, ...], index: int | None) -> object | None:
-    if index is None:
-        return None
-    if index < 0 or index >= len(row):
-        return None
-    return row[index]
-
-
-def _find_existing_customer(name: str, email: str, phone: str) -> Customer | None:
-    filters = Q(name__iexact=name) | Q(company_name__iexact=name)
-    if email:
-        filters |= Q(email__iexact=email)
-    if phone:
-        filters |= Q(phone__iexact=phone)
-    return Customer.objects.filter(filters).first()
+class _CustomerIndex:
+    """Existing customers keyed by lowercased name, company name, email and phone.
+
+    Loaded with a single query; ``find`` keeps the old lookup semantics and
+    returns the match that comes first in the model ordering.
+    """
+
+    def __init__(self, customers):
+        self._rank = {}
+        self._by_name = {}
+        self._by_email = {}
+        self._by_phone = {}
+        for customer in customers:
+            self.add(customer)
+
+    def add(self, customer: Customer) -> None:
+        self._rank.setdefault(id(customer), len(self._rank))
+        for value in (customer.name, customer.company_name):
+            if value:
+                self._by_name.setdefault(value.lower(), customer)
+        if customer.email:
+            self._by_email.setdefault(customer.email.lower(), customer)
+        if customer.phone:
+            self._by_phone.setdefault(customer.phone.lower(), customer)
+
+    def find(self, name: str, email: str, phone: str) -> Customer | None:
+        matches = [self._by_name.get(name.lower())]
+        if email:
+            matches.append(self._by_email.get(email.lower()))
+        if phone:
+            matches.append(self._by_phone.get(phone.lower()))
+        matches = [customer for customer in matches if customer is not None]
+        if not matches:
+            return None
+        return min(matches, key=lambda customer: self._rank[id(customer)])
+
+
+def _flush_customers(to_create: list[Customer], to_update: dict[int, Customer]) -> None:
+    if to_create:
+        Customer.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        # Relecture par reference : tous les backends ne renvoient pas les
+        # cles, et une ligne suivante peut mettre a jour ces clients.
+        saved = Customer.objects.only("pk", "reference").in_bulk(
+            [customer.reference for customer in to_create], field_name="reference"
+        )
+        for customer in to_create:
+            customer.pk = saved[customer.reference].pk
+        Version.record_many(to_create, Version.Action.CREATE)
+        to_create.clear()
+    if to_update:
+        customers = list(to_update.values())
+        # bulk_update ignore auto_now : updated_at est renseigne ici.
+        now = timezone.now()
+        for customer in customers:
+            customer.updated_at = now
+        Customer.objects.bulk_update(customers, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+        Version.record_many(customers, Version.Action.UPDATE)
+        to_update.clear()
 
 
 class Command(BaseCommand):
@@ -97,17 +147,27 @@ class Command(BaseCommand):
         if not headers:
             raise CommandError("Impossible de lire l'en-tete du fichier Excel.")
 
-        name_idx = _select_column(headers, NAME_HEADERS)
+        # En-tetes normalises une seule fois pour toutes les colonnes cherchees.
+        normalized_headers = [_normalize_header(header) for header in headers]
+        name_idx = _select_column(normalized_headers, NAME_HEADERS)
         if name_idx is None:
             raise CommandError("Colonne contenant le nom introuvable (ex: 'Nom complet').")
 
-        phone_idx = _select_column(headers, PHONE_HEADERS)
-        email_idx = _select_column(headers, EMAIL_HEADERS)
-        vendor_idx = _select_column(headers, VENDOR_HEADERS)
-        activity_idx = _select_column(headers, ACTIVITY_HEADERS)
-        city_idx = _select_column(headers, CITY_HEADERS)
-        country_idx = _select_column(headers, COUNTRY_HEADERS)
+        phone_idx = _select_column(normalized_headers, PHONE_HEADERS)
+        email_idx = _select_column(normalized_headers, EMAIL_HEADERS)
+        vendor_idx = _select_column(normalized_headers, VENDOR_HEADERS)
+        activity_idx = _select_column(normalized_headers, ACTIVITY_HEADERS)
+        city_idx = _select_column(normalized_headers, CITY_HEADERS)
+        country_idx = _select_column(normalized_headers, COUNTRY_HEADERS)
+
+        # Lignes lues jusqu'a la derniere colonne utile ; openpyxl les complete
+        # jusqu'a max_col, chaque indice connu se lit donc directement.
+        column_indexes = (
+            name_idx, phone_idx, email_idx, vendor_idx, activity_idx, city_idx, country_idx
+        )
+        last_column = 1 + max(idx for idx in column_indexes if idx is not None)
 
+        customers = _CustomerIndex(Customer.objects.all())
         summary = {
             "rows": 0,
             "created": 0,
@@ -115,59 +175,76 @@ class Command(BaseCommand):
             "skipped": 0,
         }
 
-        for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            summary["rows"] += 1
-            name = _clean_text(_pick_value(row, name_idx))
-            if not name:
-                summary["skipped"] += 1
-                continue
-
-            phone = _clean_text(_pick_value(row, phone_idx))
-            email = _clean_text(_pick_value(row, email_idx)).lower()
-            vendor = _clean_text(_pick_value(row, vendor_idx))
-            activity = _clean_text(_pick_value(row, activity_idx))
-            city = _clean_text(_pick_value(row, city_idx))
-            country = _clean_text(_pick_value(row, country_idx))
-
-            address_parts = [part for part in (city, country) if part]
-            address = ", ".join(address_parts)
-            notes_parts = []
-            if vendor:
-                notes_parts.append(f"Vendeur: {vendor}")
-            if activity:
-                notes_parts.append(f"Activite: {activity}")
-            notes = " | ".join(notes_parts)
-
-            customer = _find_existing_customer(name, email, phone)
-            created = False
-            if customer is None:
-                customer = Customer(
-                    name=name,
-                    reference=generate_customer_reference(),
-                )
-                created = True
-
-            updated = False
-            if phone and customer.phone != phone:
-                customer.phone = phone
-                updated = True
-            if email and customer.email != email:
-                customer.email = email
-                updated = True
-            if address and (not customer.address or customer.address != address):
-                customer.address = address
-                updated = True
-            if notes:
-                if not customer.notes:
-                    customer.notes = notes
+        to_create = []
+        to_update = {}
+        with transaction.atomic():
+            for row in sheet.iter_rows(min_row=2, max_col=last_column, values_only=True):
+                summary["rows"] += 1
+                name = _clean_text(row[name_idx])
+                if not name:
+                    summary["skipped"] += 1
+                    continue
+
+                phone = _clean_text(row[phone_idx]) if phone_idx is not None else ""
+                email = _clean_text(row[email_idx]).lower() if email_idx is not None else ""
+                vendor = _clean_text(row[vendor_idx]) if vendor_idx is not None else ""
+                activity = _clean_text(row[activity_idx]) if activity_idx is not None else ""
+                city = _clean_text(row[city_idx]) if city_idx is not None else ""
+                country = _clean_text(row[country_idx]) if country_idx is not None else ""
+
+                customer = customers.find(name, email, phone)
+                created = False
+                if customer is None:
+                    customer = Customer(
+                        name=name,
+                        reference=generate_customer_reference(),
+                    )
+                    created = True
+
+                updated = False
+                if phone and customer.phone != phone:
+                    customer.phone = phone
                     updated = True
-                elif notes not in customer.notes:
-                    customer.notes = f"{customer.notes} | {notes}"
+                if email and customer.email != email:
+                    customer.email = email
                     updated = True
-
-            if created or updated:
-                customer.save()
-                summary["created" if created else "updated"] += 1
+                # Adresse et notes ne sont construites que si la ligne en fournit.
+                if city or country:
+                    address = f"{city}, {country}" if city and country else city or country
+                    if customer.address != address:
+                        customer.address = address
+                        updated = True
+                if vendor or activity:
+                    if vendor and activity:
+                        notes = f"Vendeur: {vendor} | Activite: {activity}"
+                    elif vendor:
+                        notes = f"Vendeur: {vendor}"
+                    else:
+                        notes = f"Activite: {activity}"
+                    if not customer.notes:
+                        customer.notes = notes
+                        updated = True
+                    elif notes not in customer.notes:
+                        customer.notes = f"{customer.notes} | {notes}"
+                        updated = True
+
+                if created or updated:
+                    if created:
+                        to_create.append(customer)
+                    elif customer.pk is not None:
+                        # Un client cree plus haut dans le fichier et pas encore
+                        # insere est deja dans to_create.
+                        to_update[customer.pk] = customer
+                    # Les lignes suivantes du fichier retrouvent le client sans requete.
+                    customers.add(customer)
+                    summary["created" if created else "updated"] += 1
+                    if len(to_create) + len(to_update) >= BATCH_SIZE:
+                        _flush_customers(to_create, to_update)
+
+            _flush_customers(to_create, to_update)
+        # Les ecritures groupees n'envoient pas de signal : liste des clients
+        # du formulaire de vente invalidee a la main.
+        _invalidate_customers_cache()
 
         self.stdout.write(
             self.style.SUCCESS(
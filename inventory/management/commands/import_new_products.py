@@ -1,17 +1,20 @@
 from __future__ import annotations
 
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import DatabaseError, transaction
 
 from inventory.management.commands.import_render_products import (
+    _CatalogCache,
     _as_decimal,
+    _barcode_owners,
     _build_image_filename,
     _build_sku,
     _category_main_name,
@@ -19,12 +22,38 @@ from inventory.management.commands.import_render_products import (
     _clean_description,
     _clean_text,
     _compute_barcode,
-    _ensure_brand,
-    _ensure_category,
-    _ensure_subcategory,
     _ensure_unique_barcode,
+    _payload_reader,
 )
-from inventory.models import Product
+from inventory.models import Product, Version
+
+BATCH_SIZE = 500
+# Les SKU existants sont lus par paquets : pas de liste intermediaire de
+# tout le catalogue avant de construire l'ensemble.
+SKU_CHUNK_SIZE = 10000
+IMAGE_WORKERS = 16
+
+
+def _image_url(record: dict) -> str | None:
+    return record.get("image_1920") or record.get("image_url")
+
+
+def _build_image_session() -> requests.Session:
+    session = requests.Session()
+    # Une connexion par thread de telechargement, gardee ouverte entre images.
+    adapter = HTTPAdapter(pool_connections=IMAGE_WORKERS, pool_maxsize=IMAGE_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _fetch_image(session: requests.Session, image_url: str) -> bytes | None:
+    try:
+        response = session.get(image_url, timeout=20)
+        response.raise_for_status()
+    except Exception:
+        return None
+    return response.content or None
 
 
 class Command(BaseCommand):
@@ -52,16 +81,11 @@ class Command(BaseCommand):
         media_root = Path(settings.MEDIA_ROOT)
         media_root.mkdir(parents=True, exist_ok=True)
 
-        raw_content = file_path.read_text(encoding="utf-8")
-        try:
-            payload = json.loads(raw_content)
-        except json.JSONDecodeError as exc:
-            raise CommandError(f"Impossible de parser le fichier JSON: {exc}") from exc
+        read_records = _payload_reader(file_path)
 
-        if not isinstance(payload, list):
-            raise CommandError("Le fichier JSON doit contenir une liste de produits.")
-
-        existing_skus = set(Product.objects.values_list("sku", flat=True))
+        existing_skus = set(
+            Product.objects.values_list("sku", flat=True).iterator(chunk_size=SKU_CHUNK_SIZE)
+        )
         summary = {
             "created": 0,
             "existing": 0,
@@ -69,25 +93,35 @@ class Command(BaseCommand):
             "image_errors": 0,
             "errors": [],
         }
+        # Les codes-barres des produits en attente d'insertion y sont reserves.
+        barcode_owners = _barcode_owners()
 
-        for record in payload:
+        new_records = []
+        # Seuls les produits a creer restent en memoire, pas tout l'export.
+        for record in read_records():
             sku = _build_sku(record)
             if sku in existing_skus:
                 summary["existing"] += 1
                 continue
+            existing_skus.add(sku)
+            new_records.append((sku, record))
+        catalog = _CatalogCache()
+        catalog.prefetch(record for _, record in new_records)
+
+        session = None if options["skip_images"] else _build_image_session()
+        pending = []
+        for sku, record in new_records:
             try:
-                with transaction.atomic():
-                    product = self._create_product(record, sku)
-                summary["created"] += 1
-                existing_skus.add(sku)
-                if not options["skip_images"]:
-                    downloaded = self._download_image(product, record)
-                    if downloaded:
-                        summary["images_downloaded"] += 1
-                    elif record.get("image_1920") or record.get("image_url"):
-                        summary["image_errors"] += 1
+                pending.append(
+                    (self._build_product(record, sku, barcode_owners, catalog), record)
+                )
             except Exception as exc:  # pylint: disable=broad-except
                 summary["errors"].append(f"{sku}: {exc}")
+                continue
+            if len(pending) >= BATCH_SIZE:
+                self._flush(pending, summary, session)
+                pending = []
+        self._flush(pending, summary, session)
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -101,10 +135,77 @@ class Command(BaseCommand):
             for error in summary["errors"]:
                 self.stdout.write(f"- {error}")
 
-    def _create_product(self, record: dict, sku: str) -> Product:
-        brand = _ensure_brand(record.get("brand"))
-        category = _ensure_category(_category_main_name(record))
-        subcategory = _ensure_subcategory(category, _category_sub_name(record))
+    def _flush(self, pending: list, summary: dict, session: requests.Session | None) -> None:
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_create([product for product, _ in pending], batch_size=BATCH_SIZE)
+                # Relecture par SKU : tous les backends ne renvoient pas les cles.
+                saved = Product.objects.in_bulk(
+                    [product.sku for product, _ in pending], field_name="sku"
+                )
+                Version.record_many(saved.values(), Version.Action.CREATE)
+        except DatabaseError:
+            # SKU ou code-barres pris entre-temps, valeur refusee... : le lot est
+            # rejoue ligne par ligne pour ne rejeter que les produits fautifs.
+            saved = self._save_one_by_one(pending, summary)
+        downloads = []
+        for product, record in pending:
+            saved_product = saved.get(product.sku)
+            if saved_product is None:
+                continue
+            summary["created"] += 1
+            image_url = _image_url(record)
+            if session is not None and image_url:
+                downloads.append((saved_product, image_url))
+        if downloads:
+            self._download_images(session, downloads, summary)
+
+    def _save_one_by_one(self, pending: list, summary: dict) -> dict[str, Product]:
+        saved = {}
+        for product, _ in pending:
+            # bulk_create a pu affecter une cle avant l'annulation.
+            product.pk = None
+            product._state.adding = True
+            try:
+                with transaction.atomic():
+                    product.save()
+            except Exception as exc:  # pylint: disable=broad-except
+                summary["errors"].append(f"{product.sku}: {exc}")
+                continue
+            saved[product.sku] = product
+        return saved
+
+    def _download_images(self, session: requests.Session, downloads: list, summary: dict) -> None:
+        # Les telechargements attendent le reseau : ils tournent en parallele,
+        # l'enregistrement des fichiers et des produits reste dans ce thread.
+        with ThreadPoolExecutor(max_workers=min(IMAGE_WORKERS, len(downloads))) as executor:
+            futures = {
+                executor.submit(_fetch_image, session, image_url): (product, image_url)
+                for product, image_url in downloads
+            }
+            for future in as_completed(futures):
+                product, image_url = futures[future]
+                content = future.result()
+                if not content:
+                    summary["image_errors"] += 1
+                    continue
+                source_name = Path(urlparse(image_url).path).name or "image.jpg"
+                filename = _build_image_filename(product.sku, source_name)
+                try:
+                    product.image.save(filename, ContentFile(content), save=True)
+                except Exception as exc:  # pylint: disable=broad-except
+                    summary["errors"].append(f"{product.sku}: {exc}")
+                    continue
+                summary["images_downloaded"] += 1
+
+    def _build_product(
+        self, record: dict, sku: str, barcode_owners: dict[str, str], catalog: _CatalogCache
+    ) -> Product:
+        brand = catalog.brand(record.get("brand"))
+        category = catalog.category(_category_main_name(record))
+        subcategory = catalog.subcategory(category, _category_sub_name(record))
         name = _clean_text(record.get("name"))
         if not name:
             identifier = record.get("odoo_id") or record.get("id")
@@ -118,10 +219,10 @@ class Command(BaseCommand):
             record.get("short_description")
         )
         raw_barcode = _compute_barcode(record)
-        barcode = _ensure_unique_barcode(raw_barcode, sku)
+        barcode = _ensure_unique_barcode(raw_barcode, sku, barcode_owners)
         sale_price = _as_decimal(record.get("list_price"))
 
-        product = Product.objects.create(
+        return Product(
             sku=sku,
             name=name,
             manufacturer_reference=manufacturer_reference,
@@ -132,21 +233,3 @@ class Command(BaseCommand):
             barcode=barcode,
             sale_price=sale_price,
         )
-        return product
-
-    def _download_image(self, product: Product, record: dict) -> bool:
-        image_url = record.get("image_1920") or record.get("image_url")
-        if not image_url:
-            return False
-        parsed = urlparse(image_url)
-        source_name = Path(parsed.path).name or "image.jpg"
-        filename = _build_image_filename(product.sku, source_name)
-        try:
-            response = requests.get(image_url, timeout=20)
-            response.raise_for_status()
-        except Exception:
-            return False
-        if not response.content:
-            return False
-        product.image.save(filename, ContentFile(response.content), save=True)
-        return True
@@ -3,12 +3,13 @@ from __future__ import annotations
 import json
 import re
 from decimal import Decimal
+from itertools import islice
 from pathlib import Path
 
 from django.conf import settings
 from django.core.files import File
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import DatabaseError, transaction
 from django.utils import timezone
 
 from inventory.models import (
@@ -17,15 +18,37 @@ from inventory.models import (
     MovementType,
     Product,
     StockMovement,
+    SubCategory,
+    Version,
     get_default_site,
 )
 
+try:  # pragma: no cover
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
 
 DEFAULT_BRAND_NAME = "Générique"
 DEFAULT_CATEGORY_NAME = "Non classé"
 SKU_MAX_LENGTH = 100
 IMPORT_ENTRY_CODE = "IMPORT_RENDER_IN"
 IMPORT_EXIT_CODE = "IMPORT_RENDER_OUT"
+CHUNK_SIZE = 500
+PRODUCT_UPDATE_FIELDS = [
+    "name",
+    "manufacturer_reference",
+    "description",
+    "barcode",
+    "sale_price",
+    "brand",
+    "category",
+    "subcategory",
+    "image",
+    "updated_at",
+]
+_SKU_INVALID_CHARS = re.compile(r"[^0-9A-Za-z_-]+")
+_FILENAME_INVALID_CHARS = re.compile(r"[^0-9A-Za-z._-]+")
 
 
 def _clean_text(value: str | None) -> str:
@@ -43,7 +66,7 @@ def _clean_description(value: str | None) -> str:
 
 
 def _sanitize_sku_segment(value: str) -> str:
-    cleaned = re.sub(r"[^0-9A-Za-z_-]+", "-", value)
+    cleaned = _SKU_INVALID_CHARS.sub("-", value)
     cleaned = cleaned.strip("-_")
     return cleaned or "PROD"
 
@@ -75,30 +98,100 @@ def _as_decimal(value) -> Decimal | None:
         return None
 
 
-def _ensure_brand(name: str | None) -> Brand:
-    cleaned = _clean_text(name)
-    if not cleaned:
-        cleaned = DEFAULT_BRAND_NAME
-    brand, _ = Brand.objects.get_or_create(name=cleaned)
-    return brand
+def _brand_name(value: str | None) -> str:
+    return _clean_text(value) or DEFAULT_BRAND_NAME
 
 
-def _ensure_category(name: str | None) -> Category:
-    cleaned = _clean_text(name)
-    if not cleaned:
-        cleaned = DEFAULT_CATEGORY_NAME
-    category, _ = Category.objects.get_or_create(name=cleaned)
-    return category
+def _category_name(value: str | None) -> str:
+    return _clean_text(value) or DEFAULT_CATEGORY_NAME
 
 
-def _ensure_subcategory(category: Category, name: str | None):
-    from inventory.models import SubCategory
+class _CatalogCache:
+    """Brands, categories and subcategories of an import, keyed by name.
 
-    cleaned = _clean_text(name)
-    if not cleaned:
-        return None
-    subcategory, _ = SubCategory.objects.get_or_create(category=category, name=cleaned)
-    return subcategory
+    ``prefetch`` loads the existing rows once and inserts the names of the
+    payload that are missing in bulk; the lookups then run from memory and
+    only fall back to ``get_or_create`` for records it did not see.
+    """
+
+    def __init__(self):
+        self.brands = {}
+        self.categories = {}
+        self.subcategories = {}
+
+    def prefetch(self, records) -> None:
+        # Un seul passage sur le flux : seuls les noms distincts sont gardes.
+        brand_names = set()
+        category_names = set()
+        sub_names = set()
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            brand_names.add(_brand_name(record.get("brand")))
+            category_name = _category_name(_category_main_name(record))
+            category_names.add(category_name)
+            sub_name = _clean_text(_category_sub_name(record))
+            if sub_name:
+                sub_names.add((category_name, sub_name))
+
+        self.brands = {brand.name: brand for brand in Brand.objects.all()}
+        self.brands.update(
+            self._create_missing(Brand, brand_names - self.brands.keys())
+        )
+
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.categories.update(
+            self._create_missing(Category, category_names - self.categories.keys())
+        )
+
+        sub_keys = {
+            (self.categories[category_name].pk, name) for category_name, name in sub_names
+        }
+        self.subcategories = {
+            (subcategory.category_id, subcategory.name): subcategory
+            for subcategory in SubCategory.objects.all()
+        }
+        missing = sub_keys - self.subcategories.keys()
+        if missing:
+            SubCategory.objects.bulk_create(
+                [SubCategory(category_id=category_id, name=name) for category_id, name in missing],
+                ignore_conflicts=True,
+            )
+            self.subcategories = {
+                (subcategory.category_id, subcategory.name): subcategory
+                for subcategory in SubCategory.objects.all()
+            }
+
+    @staticmethod
+    def _create_missing(model, names) -> dict:
+        if not names:
+            return {}
+        # ignore_conflicts ne renvoie pas les cles primaires : relecture par nom.
+        model.objects.bulk_create([model(name=name) for name in names], ignore_conflicts=True)
+        return {obj.name: obj for obj in model.objects.filter(name__in=names)}
+
+    def brand(self, name: str | None) -> Brand:
+        cleaned = _brand_name(name)
+        if cleaned not in self.brands:
+            self.brands[cleaned], _ = Brand.objects.get_or_create(name=cleaned)
+        return self.brands[cleaned]
+
+    def category(self, name: str | None) -> Category:
+        cleaned = _category_name(name)
+        if cleaned not in self.categories:
+            self.categories[cleaned], _ = Category.objects.get_or_create(name=cleaned)
+        return self.categories[cleaned]
+
+    def subcategory(self, category: Category, name: str | None) -> SubCategory | None:
+        cleaned = _clean_text(name)
+        if not cleaned:
+            return None
+        key = (category.pk, cleaned)
+        if key not in self.subcategories:
+            self.subcategories[key], _ = SubCategory.objects.get_or_create(
+                category=category, name=cleaned
+            )
+        return self.subcategories[key]
 
 
 def _category_main_name(record: dict) -> str | None:
@@ -122,11 +215,58 @@ def _compute_barcode(record: dict) -> str | None:
     return cleaned
 
 
-def _ensure_unique_barcode(barcode: str | None, sku: str) -> str | None:
+def _barcode_owners() -> dict[str, str]:
+    """SKU of the product holding each barcode, loaded in one query."""
+    return dict(
+        Product.objects.exclude(barcode__isnull=True)
+        .exclude(barcode="")
+        .values_list("barcode", "sku")
+        .iterator(chunk_size=10000)
+    )
+
+
+def _ensure_unique_barcode(
+    barcode: str | None, sku: str, barcode_owners: dict[str, str]
+) -> str | None:
+    """Return ``barcode`` if no other SKU holds it, and reserve it for ``sku``."""
     if not barcode:
         return None
-    conflict = Product.objects.filter(barcode=barcode).exclude(sku=sku).exists()
-    return None if conflict else barcode
+    owner = barcode_owners.setdefault(barcode, sku)
+    return barcode if owner == sku else None
+
+
+def _payload_reader(file_path: Path):
+    """Return a function yielding the records of the JSON export.
+
+    With ijson each call streams the file again, so a large export is never
+    held in memory; without it the file is parsed once with json.
+    """
+    if ijson is None:
+        try:
+            with file_path.open("rb") as handle:
+                payload = json.load(handle)
+        except json.JSONDecodeError as exc:
+            raise CommandError(f"Impossible de parser le fichier JSON: {exc}") from exc
+        if not isinstance(payload, list):
+            raise CommandError("Le fichier JSON doit contenir une liste de produits.")
+        return lambda: iter(payload)
+
+    try:
+        with file_path.open("rb") as handle:
+            _, first_event, _ = next(ijson.parse(handle), (None, None, None))
+    except ijson.JSONError as exc:
+        raise CommandError(f"Impossible de parser le fichier JSON: {exc}") from exc
+    if first_event != "start_array":
+        raise CommandError("Le fichier JSON doit contenir une liste de produits.")
+
+    def read_records():
+        with file_path.open("rb") as handle:
+            try:
+                yield from ijson.items(handle, "item", use_float=True)
+            except ijson.JSONError as exc:
+                raise CommandError(f"Impossible de parser le fichier JSON: {exc}") from exc
+
+    return read_records
 
 
 def _resolve_image_path(images_root: Path, relative_path: str | None) -> Path | None:
@@ -142,7 +282,7 @@ def _resolve_image_path(images_root: Path, relative_path: str | None) -> Path |
 
 
 def _build_image_filename(sku: str, source_name: str) -> str:
-    cleaned_name = re.sub(r"[^0-9A-Za-z._-]+", "_", source_name)
+    cleaned_name = _FILENAME_INVALID_CHARS.sub("_", source_name)
     cleaned_name = cleaned_name.strip("_") or source_name
     base_name = f"{sku}_{cleaned_name}"
     return base_name[:200]
@@ -204,11 +344,7 @@ class Command(BaseCommand):
             },
         )
 
-        raw_content = file_path.read_text(encoding="utf-8")
-        try:
-            payload = json.loads(raw_content)
-        except json.JSONDecodeError as exc:
-            raise CommandError(f"Impossible de parser le fichier JSON: {exc}") from exc
+        read_records = _payload_reader(file_path)
 
         summary = {
             "created": 0,
@@ -220,21 +356,24 @@ class Command(BaseCommand):
             "errors": [],
         }
 
-        with transaction.atomic():
-            for record in payload:
-                try:
-                    self._import_record(
-                        record,
-                        images_root,
-                        entry_type,
-                        exit_type,
-                        summary,
-                        movement_site,
-                    )
-                except Exception as exc:
-                    summary["errors"].append(
-                        f"{record.get('default_code') or record.get('name') or record.get('id')}: {exc}"
-                    )
+        catalog = _CatalogCache()
+        catalog.prefetch(read_records())
+        barcode_owners = _barcode_owners()
+
+        records = read_records()
+        while chunk := list(islice(records, CHUNK_SIZE)):
+            # Une transaction par lot : verrous et journal restent courts.
+            with transaction.atomic():
+                self._import_chunk(
+                    chunk,
+                    images_root,
+                    entry_type,
+                    exit_type,
+                    summary,
+                    movement_site,
+                    catalog,
+                    barcode_owners,
+                )
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -249,19 +388,174 @@ class Command(BaseCommand):
             for error in summary["errors"]:
                 self.stdout.write(f"- {error}")
 
-    def _import_record(
+    def _import_chunk(
         self,
-        record: dict,
+        chunk: list,
         images_root: Path,
         entry_type: MovementType,
         exit_type: MovementType,
         summary: dict,
         site,
-    ):
-        sku = _build_sku(record)
-        brand = _ensure_brand(record.get("brand"))
-        category = _ensure_category(_category_main_name(record))
-        subcategory = _ensure_subcategory(category, _category_sub_name(record))
+        catalog: _CatalogCache,
+        barcode_owners: dict[str, str],
+    ) -> None:
+        skus = [_build_sku(record) if isinstance(record, dict) else None for record in chunk]
+        # Produits du lot deja en base, avec leur stock : une seule requete.
+        products = Product.objects.with_stock_quantity().in_bulk(
+            [sku for sku in skus if sku], field_name="sku"
+        )
+        to_create = {}
+        to_update = {}
+        targets = []
+        for sku, record in zip(skus, chunk):
+            try:
+                product, desired_stock, outcome = self._import_record(
+                    record,
+                    sku,
+                    products,
+                    to_create,
+                    to_update,
+                    images_root,
+                    summary,
+                    catalog,
+                    barcode_owners,
+                )
+            except Exception as exc:
+                summary["errors"].append(
+                    f"{record.get('default_code') or record.get('name') or record.get('id')}: {exc}"
+                )
+                continue
+            targets.append((product, desired_stock, outcome, record))
+
+        failed = self._save_products(to_create, to_update, summary)
+
+        movements = []
+        # Un SKU present deux fois dans le lot : le second mouvement tient
+        # compte du premier, pas encore en base.
+        pending_stock = {}
+        for product, desired_stock, outcome, record in targets:
+            if product.sku in failed:
+                continue
+            if outcome:
+                summary[outcome] += 1
+            current_stock = getattr(product, "current_stock", 0) + pending_stock.get(product.pk, 0)
+            delta = desired_stock - current_stock
+            if delta == 0:
+                continue
+            pending_stock[product.pk] = pending_stock.get(product.pk, 0) + delta
+            movements.append(
+                StockMovement(
+                    product=product,
+                    movement_type=entry_type if delta > 0 else exit_type,
+                    quantity=abs(delta),
+                    movement_date=timezone.now(),
+                    comment="Import Render",
+                    document_number=f"RENDER-{record.get('odoo_id') or record.get('id')}",
+                    site=site,
+                )
+            )
+        summary["stock_movements"] += self._save_movements(movements, summary)
+
+    def _save_movements(self, movements: list[StockMovement], summary: dict) -> int:
+        """Insert the chunk's stock movements and return how many were saved."""
+        try:
+            with transaction.atomic():
+                StockMovement.objects.bulk_create(movements, batch_size=CHUNK_SIZE)
+                Version.record_many(movements, Version.Action.CREATE)
+        except DatabaseError:
+            # Comme pour les produits : seul le mouvement fautif est rejete.
+            saved = 0
+            for movement in movements:
+                movement.pk = None
+                movement._state.adding = True
+                try:
+                    with transaction.atomic():
+                        movement.save()
+                except Exception as exc:
+                    summary["errors"].append(f"{movement.product.sku}: {exc}")
+                    continue
+                saved += 1
+            return saved
+        return len(movements)
+
+    def _save_products(
+        self, to_create: dict[str, Product], to_update: dict[str, Product], summary: dict
+    ) -> set[str]:
+        """Write the chunk's products and return the SKUs that could not be saved."""
+        created = list(to_create.values())
+        updated = list(to_update.values())
+        # bulk_update ignore auto_now : updated_at est renseigne ici.
+        now = timezone.now()
+        for product in updated:
+            product.updated_at = now
+        try:
+            with transaction.atomic():
+                # Les mises a jour d'abord : un code-barres libere par un produit
+                # existant peut etre repris par un produit cree dans le meme lot.
+                if updated:
+                    Product.objects.bulk_update(
+                        updated, PRODUCT_UPDATE_FIELDS, batch_size=CHUNK_SIZE
+                    )
+                    Version.record_many(updated, Version.Action.UPDATE)
+                if created:
+                    Product.objects.bulk_create(created, batch_size=CHUNK_SIZE)
+                    # Relecture par SKU : tous les backends ne renvoient pas les
+                    # cles, et les mouvements du lot en ont besoin.
+                    saved = Product.objects.only("pk", "sku").in_bulk(
+                        [product.sku for product in created], field_name="sku"
+                    )
+                    for product in created:
+                        product.pk = saved[product.sku].pk
+                    Version.record_many(created, Version.Action.CREATE)
+        except DatabaseError:
+            # Conflit de code-barres, valeur refusee... : le lot est rejoue
+            # ligne par ligne pour ne rejeter que les produits fautifs.
+            return self._save_products_one_by_one(created, updated, summary)
+        return set()
+
+    def _save_products_one_by_one(
+        self, created: list[Product], updated: list[Product], summary: dict
+    ) -> set[str]:
+        failed = set()
+        for product in updated:
+            try:
+                with transaction.atomic():
+                    product.save(update_fields=PRODUCT_UPDATE_FIELDS)
+            except Exception as exc:
+                summary["errors"].append(f"{product.sku}: {exc}")
+                failed.add(product.sku)
+        for product in created:
+            # bulk_create a pu affecter une cle avant l'annulation.
+            product.pk = None
+            product._state.adding = True
+            try:
+                with transaction.atomic():
+                    product.save()
+            except Exception as exc:
+                summary["errors"].append(f"{product.sku}: {exc}")
+                failed.add(product.sku)
+        return failed
+
+    def _import_record(
+        self,
+        record: dict,
+        sku: str,
+        products: dict[str, Product],
+        to_create: dict[str, Product],
+        to_update: dict[str, Product],
+        images_root: Path,
+        summary: dict,
+        catalog: _CatalogCache,
+        barcode_owners: dict[str, str],
+    ) -> tuple[Product, int, str | None]:
+        """Apply ``record`` to its product in memory and queue it for saving.
+
+        Returns the product, the stock quantity the payload expects and the
+        summary counter to bump once the product is saved (``None`` if unchanged).
+        """
+        brand = catalog.brand(record.get("brand"))
+        category = catalog.category(_category_main_name(record))
+        subcategory = catalog.subcategory(category, _category_sub_name(record))
         name = _clean_text(record.get("name"))
         if not name:
             identifier = record.get("odoo_id") or record.get("id")
@@ -275,24 +569,28 @@ class Command(BaseCommand):
             record.get("short_description")
         )
         raw_barcode = _compute_barcode(record)
-        barcode = _ensure_unique_barcode(raw_barcode, sku)
+        barcode = _ensure_unique_barcode(raw_barcode, sku, barcode_owners)
         if raw_barcode and not barcode:
             summary["skipped_barcodes"] += 1
         sale_price = _as_decimal(record.get("list_price"))
-        defaults = {
-            "name": name,
-            "manufacturer_reference": manufacturer_reference,
-            "brand": brand,
-            "category": category,
-            "subcategory": subcategory,
-            "description": description,
-            "barcode": barcode,
-            "sale_price": sale_price,
-        }
-        product, created = Product.objects.get_or_create(sku=sku, defaults=defaults)
-        updated = False
 
-        if not created:
+        product = products.get(sku)
+        created = product is None
+        updated = False
+        if created:
+            product = Product(
+                sku=sku,
+                name=name,
+                manufacturer_reference=manufacturer_reference,
+                brand=brand,
+                category=category,
+                subcategory=subcategory,
+                description=description,
+                barcode=barcode,
+                sale_price=sale_price,
+            )
+            products[sku] = to_create[sku] = product
+        else:
             if product.name != name:
                 product.name = name
                 updated = True
@@ -303,24 +601,23 @@ class Command(BaseCommand):
                 product.description = description
                 updated = True
             if barcode and product.barcode != barcode:
+                if product.barcode:
+                    barcode_owners.pop(product.barcode, None)
                 product.barcode = barcode
                 updated = True
             if sale_price is not None and product.sale_price != sale_price:
                 product.sale_price = sale_price
                 updated = True
-            if product.brand != brand:
+            if product.brand_id != brand.pk:
                 product.brand = brand
                 updated = True
-            if product.category != category:
+            if product.category_id != category.pk:
                 product.category = category
                 updated = True
-            if product.subcategory != subcategory:
+            if product.subcategory_id != (subcategory.pk if subcategory else None):
                 product.subcategory = subcategory
                 updated = True
-        if created:
-            summary["created"] += 1
-        elif updated:
-            summary["updated"] += 1
+        outcome = "created" if created else "updated" if updated else None
 
         image_relative = record.get("local_image")
         image_path = _resolve_image_path(images_root, image_relative)
@@ -336,27 +633,13 @@ class Command(BaseCommand):
         elif image_relative:
             summary["missing_images"] += 1
 
-        if created or updated or image_saved:
-            product.save()
+        # Un produit cree plus haut dans le lot est deja dans to_create.
+        if (updated or image_saved) and product.pk is not None:
+            to_update[sku] = product
 
-        desired_stock = 0
         stock_raw = record.get("stock_quantity")
         try:
             desired_stock = max(int(float(stock_raw or 0)), 0)
         except (ValueError, TypeError):
             desired_stock = 0
-        current_stock = product.stock_quantity
-        delta = desired_stock - current_stock
-        if delta == 0:
-            return
-        movement_type = entry_type if delta > 0 else exit_type
-        StockMovement.objects.create(
-            product=product,
-            movement_type=movement_type,
-            quantity=abs(delta),
-            movement_date=timezone.now(),
-            comment="Import Render",
-            document_number=f"RENDER-{record.get('odoo_id') or record.get('id')}",
-            site=site,
-        )
-        summary["stock_movements"] += 1
+        return product, desired_stock, outcome
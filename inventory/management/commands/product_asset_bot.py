@@ -10,6 +10,10 @@ from inventory.product_asset import (
 )
 
 
+OUTPUT_CHUNK = 500
+PRODUCT_CHUNK = 1000
+
+
 class Command(BaseCommand):
     help = "Queue the AI product asset bot to enrich descriptions and images."
 
@@ -54,6 +58,11 @@ class Command(BaseCommand):
             action="store_true",
             help="Regenerate blog content even if it exists.",
         )
+        parser.add_argument(
+            "--by-name",
+            action="store_true",
+            help="Process products in name order (default: primary key order, no sort on name).",
+        )
         parser.add_argument(
             "--dry-run",
             action="store_true",
@@ -67,26 +76,38 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         assets = _normalize_assets(options.get("assets"))
-        queryset = Product.objects.all().order_by("name")
+        # Seuls pk, sku et name servent ici : le bot recharge le produit complet.
+        # Product.name n'est pas indexe : trier dessus impose un tri complet cote base.
+        ordering = "name" if options["by_name"] else "pk"
+        queryset = Product.objects.only("pk", "sku", "name").order_by(ordering)
         if "description" in assets and not options["force_description"]:
             queryset = queryset.filter(Q(description="") | Q(description__isnull=True))
         if "images" in assets and not options["force_image"]:
             queryset = queryset.filter(Q(image="") | Q(image__isnull=True))
 
-        products = list(queryset)
         limit = options.get("limit")
         if limit:
-            products = products[:limit]
+            queryset = queryset[:limit]
 
         inline_mode = options["inline"] or settings.PRODUCT_BOT_INLINE_RUN
-        if not products:
+        if not queryset.exists():
             self.stdout.write("No products matched the criteria.")
             return
 
+        # Lignes ecrites par paquets ; le mode inline, lent, reste affiche au fil de l'eau.
+        lines: list[str] = []
+        if inline_mode:
+            # Le bot ecrit les colonnes filtrees par le queryset : pas de
+            # curseur ouvert pendant ces ecritures (SQLite), les PK sont lus d'abord.
+            products = _products_by_pk_chunks(queryset)
+        else:
+            products = queryset.iterator(chunk_size=PRODUCT_CHUNK)
         for product in products:
+            if len(lines) >= OUTPUT_CHUNK:
+                self._flush(lines)
             if options["dry_run"]:
                 verb = "queue" if not inline_mode else "process"
-                self.stdout.write(f"Would {verb} bot for {product.sku} ({product.name})")
+                lines.append(f"Would {verb} bot for {product.sku} ({product.name})")
                 continue
             job, created = reserve_product_asset_job(
                 product,
@@ -100,7 +121,7 @@ class Command(BaseCommand):
                 force_blog=options["force_blog"],
             )
             if not created:
-                self.stdout.write(f"{product.sku} est déjà en file d'attente.")
+                lines.append(f"{product.sku} est déjà en file d'attente.")
                 continue
             if inline_mode:
                 run_product_asset_bot(
@@ -114,7 +135,8 @@ class Command(BaseCommand):
                     force_blog=options["force_blog"],
                     job_id=job.pk,
                 )
-                self.stdout.write(f"Processed bot inline for {product.sku} ({product.name})")
+                lines.append(f"Processed bot inline for {product.sku} ({product.name})")
+                self._flush(lines)
             else:
                 enqueue_product_asset_job(
                     job.pk,
@@ -127,7 +149,24 @@ class Command(BaseCommand):
                     force_videos=options["force_videos"],
                     force_blog=options["force_blog"],
                 )
-                self.stdout.write(f"Queued bot for {product.sku} ({product.name})")
+                lines.append(f"Queued bot for {product.sku} ({product.name})")
+        self._flush(lines)
+
+    def _flush(self, lines: list[str]) -> None:
+        if lines:
+            self.stdout.write("\n".join(lines))
+            lines.clear()
+
+
+def _products_by_pk_chunks(queryset):
+    """Yield the products of ``queryset`` in order, from a PK list read up front."""
+    pks = list(queryset.values_list("pk", flat=True))
+    for start in range(0, len(pks), PRODUCT_CHUNK):
+        chunk = pks[start:start + PRODUCT_CHUNK]
+        products = Product.objects.only("pk", "sku", "name").in_bulk(chunk)
+        for pk in chunk:
+            if pk in products:
+                yield products[pk]
 
 
 def _normalize_assets(raw: str | None) -> list[str]:
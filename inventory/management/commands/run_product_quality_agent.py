@@ -1,8 +1,43 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.management.base import BaseCommand
+from django.db import connection
 
 from inventory.models import Product
 from inventory.quality_agent import ProductQualityAgent
 
+DEFAULT_WORKERS = 1
+
+_thread_state = threading.local()
+
+
+def _improve(agent: ProductQualityAgent, product: Product) -> dict:
+    # Un produit en echec (IA, reseau, base) est signale sans arreter les autres.
+    try:
+        return agent.improve_if_needed(product)
+    except Exception as exc:  # noqa: BLE001
+        return {
+            "product_id": product.id,
+            "sku": product.sku,
+            "score": "?",
+            "status": "error",
+            "changed": False,
+            "error": str(exc),
+        }
+
+
+def _improve_in_thread(product: Product, threshold: int) -> dict:
+    # Un agent (et son client IA) par thread ; la connexion ouverte par le
+    # thread est refermee apres chaque produit.
+    agent = getattr(_thread_state, "agent", None)
+    if agent is None:
+        agent = _thread_state.agent = ProductQualityAgent(threshold=threshold)
+    try:
+        return _improve(agent, product)
+    finally:
+        connection.close()
+
 
 class Command(BaseCommand):
     help = "Audit product quality and auto-improve low-scoring products with AI enrichment."
@@ -11,11 +46,18 @@ class Command(BaseCommand):
         parser.add_argument("--product-id", type=int, help="Audit only one product id")
         parser.add_argument("--threshold", type=int, default=70, help="Minimum quality score")
         parser.add_argument("--limit", type=int, default=50, help="Max products to process")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=DEFAULT_WORKERS,
+            help="Products enriched in parallel (AI calls wait on the network); default 1, no threads.",
+        )
 
     def handle(self, *args, **options):
         threshold = int(options["threshold"])
         limit = int(options["limit"])
         product_id = options.get("product_id")
+        workers = max(1, int(options["workers"]))
 
         queryset = Product.objects.select_related("brand", "category").order_by("id")
         if product_id:
@@ -26,22 +68,31 @@ class Command(BaseCommand):
             self.stdout.write(self.style.WARNING("Aucun produit trouvé."))
             return
 
-        agent = ProductQualityAgent(threshold=threshold)
-        changed_count = 0
+        if workers == 1 or len(products) == 1:
+            agent = ProductQualityAgent(threshold=threshold)
+            changed_count = self._report(_improve(agent, product) for product in products)
+        else:
+            # map() rend les resultats dans l'ordre de soumission.
+            with ThreadPoolExecutor(max_workers=min(workers, len(products))) as executor:
+                results = executor.map(_improve_in_thread, products, [threshold] * len(products))
+                changed_count = self._report(results)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Traitement terminé: {len(products)} produit(s), {changed_count} amélioré(s)."
+            )
+        )
 
-        for product in products:
-            result = agent.improve_if_needed(product)
+    def _report(self, results) -> int:
+        changed_count = 0
+        for result in results:
             line = (
                 f"[{result['status']}] {result['sku']} "
                 f"score={result['score']}"
                 + (f"->{result['score_after']}" if "score_after" in result else "")
+                + (f" ({result['error']})" if "error" in result else "")
             )
             self.stdout.write(line)
             if result["changed"]:
                 changed_count += 1
-
-        self.stdout.write(
-            self.style.SUCCESS(
-                f"Traitement terminé: {len(products)} produit(s), {changed_count} amélioré(s)."
-            )
-        )
+        return changed_count
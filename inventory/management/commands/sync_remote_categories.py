@@ -2,17 +2,38 @@ from __future__ import annotations
 
 import json
 import re
+import tempfile
+from collections import defaultdict
 from dataclasses import dataclass
+from itertools import chain, islice
 
 import requests
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import DatabaseError, transaction
+from django.utils import timezone
 
 from inventory.bot import MistralTextGenerator
-from inventory.models import Category, Product, SubCategory
+from inventory.models import Category, Product, SubCategory, Version
+
+try:  # pragma: no cover
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 DEFAULT_SOURCE_URL = "https://samr.pythonanywhere.com/api/products/"
+BATCH_SIZE = 500
+PRODUCT_UPDATE_FIELDS = ["category", "subcategory", "updated_at"]
+# Au-dela, le flux telecharge passe de la memoire a un fichier temporaire.
+FEED_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+_JSON_BLOCK_RE = re.compile(r"\{.*\}", re.DOTALL)
+# orjson.JSONDecodeError herite de json.JSONDecodeError : memes except.
+_json_loads = orjson.loads if orjson is not None else json.loads
 
 
 @dataclass
@@ -21,23 +42,35 @@ class CategorySuggestion:
     subcategory: str | None = None
 
 
-def _clean(value: str | None) -> str:
-    return " ".join((value or "").split()).strip()
+def _clean(value) -> str:
+    # Le flux peut donner des SKU numeriques : tout est ramene a du texte.
+    return " ".join(str(value or "").split()).strip()
 
 
 def _parse_response(raw: str) -> CategorySuggestion | None:
     if not raw:
         return None
     text = raw.strip()
+    # Cas courant : le modele renvoie directement le JSON demande.
+    try:
+        payload = _json_loads(text)
+    except json.JSONDecodeError:
+        payload = None
+    if isinstance(payload, dict):
+        return _build_suggestion(payload)
     if text.startswith("```"):
         text = text.strip("`").strip()
-    match = re.search(r"\{.*\}", text, flags=re.DOTALL)
+    match = _JSON_BLOCK_RE.search(text)
     if match:
         text = match.group(0)
     try:
-        payload = json.loads(text)
+        payload = _json_loads(text)
     except json.JSONDecodeError:
         return None
+    return _build_suggestion(payload)
+
+
+def _build_suggestion(payload: dict) -> CategorySuggestion | None:
     category = _clean(payload.get("category"))
     subcategory = _clean(payload.get("subcategory"))
     if not category or category.lower() in {"none", "null", "n/a"}:
@@ -47,14 +80,96 @@ def _parse_response(raw: str) -> CategorySuggestion | None:
     return CategorySuggestion(category=category, subcategory=subcategory)
 
 
-def _build_prompt(product: dict, categories: list[Category], max_subcategories: int = 100) -> str:
+def _download_feed(source_url: str, timeout: int):
+    """Download the remote feed into a temporary file, rewound for reading.
+
+    The body is fetched in one go: parsing it while the products wait on
+    Mistral would leave the connection idle for minutes.
+    """
+    feed = tempfile.SpooledTemporaryFile(max_size=FEED_SPOOL_MAX_SIZE)
+    try:
+        with requests.get(source_url, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            for block in response.iter_content(chunk_size=64 * 1024):
+                feed.write(block)
+    except BaseException:
+        feed.close()
+        raise
+    feed.seek(0)
+    return feed
+
+
+def _feed_items(feed):
+    """Yield the products of the downloaded feed (a list or an object with ``results``).
+
+    With ijson the file is parsed incrementally, so the feed is never held
+    in memory; without it the whole body is decoded at once.
+    """
+    if ijson is None:
+        payload = _json_loads(feed.read())
+        items = payload.get("results") if isinstance(payload, dict) else payload
+        if not isinstance(items, list):
+            raise CommandError("Le flux distant doit etre une liste ou un objet avec 'results'.")
+        yield from items
+        return
+
+    has_results = False
+
+    def watch_results(events):
+        nonlocal has_results
+        for event in events:
+            if event[0] == "results" and event[1] == "start_array":
+                has_results = True
+            yield event
+
+    events = ijson.parse(feed, use_float=True)
+    try:
+        first = next(events, None)
+        if first is None or first[1] not in ("start_array", "start_map"):
+            raise CommandError("Le flux distant doit etre une liste ou un objet avec 'results'.")
+        if first[1] == "start_array":
+            yield from ijson.items(chain([first], events), "item")
+            return
+        yield from ijson.items(watch_results(chain([first], events)), "results.item")
+    except ijson.JSONError as exc:
+        raise CommandError(f"Flux distant JSON invalide: {exc}") from exc
+    if not has_results:
+        raise CommandError("Le flux distant doit etre une liste ou un objet avec 'results'.")
+
+
+def _format_taxonomy(max_subcategories: int = 100) -> str:
+    # Deux requetes au total, quel que soit le nombre de categories.
+    subcategories_by_category: dict[int, list[str]] = defaultdict(list)
+    rows = SubCategory.objects.order_by("category_id", "name").values_list("category_id", "name")
+    for category_id, name in rows:
+        names = subcategories_by_category[category_id]
+        if len(names) < max_subcategories:
+            names.append(name)
     category_lines = []
-    for category in categories:
-        subs = list(category.subcategories.order_by("name").values_list("name", flat=True)[:max_subcategories])
+    for category_id, category_name in Category.objects.values_list("id", "name"):
+        subs = subcategories_by_category.get(category_id)
         if subs:
-            category_lines.append(f"- {category.name} -> {', '.join(subs)}")
+            category_lines.append(f"- {category_name} -> {', '.join(subs)}")
         else:
-            category_lines.append(f"- {category.name}")
+            category_lines.append(f"- {category_name}")
+    return "\n".join(category_lines) if category_lines else "(aucune)"
+
+
+def _build_prompt_prefix(taxonomy_block: str) -> str:
+    # Partie commune a tous les produits d'une synchronisation.
+    return (
+        "Tu classifies des produits de securite electronique. "
+        "Retourne exactement un JSON sur une ligne: "
+        '{"category":"...","subcategory":"..."}. '
+        "Tu peux creer une nouvelle categorie ou sous-categorie si necessaire. "
+        "Si la sous-categorie n'est pas utile, mets null.\n\n"
+        "Categories actuelles:\n"
+        + taxonomy_block
+        + "\n\nProduit:\n"
+    )
+
+
+def _build_prompt(product: dict, prompt_prefix: str) -> str:
     details = [
         f"Nom: {_clean(product.get('name'))}",
         f"SKU: {_clean(product.get('sku'))}",
@@ -62,16 +177,7 @@ def _build_prompt(product: dict, categories: list[Category], max_subcategories:
         f"Reference: {_clean(product.get('manufacturer_reference'))}",
         f"Description: {_clean(product.get('description'))[:280]}",
     ]
-    return (
-        "Tu classifies des produits de securite electronique. "
-        "Retourne exactement un JSON sur une ligne: "
-        '{"category":"...","subcategory":"..."}. '\
-        "Tu peux creer une nouvelle categorie ou sous-categorie si necessaire. "
-        "Si la sous-categorie n'est pas utile, mets null.\n\n"
-        + "\n".join(details)
-        + "\n\nCategories actuelles:\n"
-        + ("\n".join(category_lines) if category_lines else "(aucune)")
-    )
+    return prompt_prefix + "\n".join(details)
 
 
 class Command(BaseCommand):
@@ -83,21 +189,17 @@ class Command(BaseCommand):
         parser.add_argument("--dry-run", action="store_true")
         parser.add_argument("--timeout", type=int, default=25)
         parser.add_argument("--no-ai", action="store_true", help="Utilise uniquement category/subcategory du flux JSON.")
+        parser.add_argument(
+            "--ai-only-missing",
+            action="store_true",
+            help="N'appelle Mistral que si le flux n'a pas deja category et subcategory (bien plus rapide).",
+        )
 
     def handle(self, *args, **options):
         source_url = options["source_url"]
         timeout = max(5, int(options["timeout"]))
         use_ai = not options["no_ai"]
 
-        response = requests.get(source_url, timeout=timeout)
-        response.raise_for_status()
-        payload = response.json()
-        items = payload.get("results") if isinstance(payload, dict) else payload
-        if not isinstance(items, list):
-            raise CommandError("Le flux distant doit etre une liste ou un objet avec 'results'.")
-        if options["limit"]:
-            items = items[: int(options["limit"])]
-
         generator = None
         if use_ai:
             api_key = getattr(settings, "MISTRAL_API_KEY", None)
@@ -117,13 +219,21 @@ class Command(BaseCommand):
             "errors": 0,
         }
 
-        for product_data in items:
-            summary["processed"] += 1
-            try:
-                self._process_product(product_data, generator, options["dry_run"], summary)
-            except Exception as exc:  # noqa: BLE001
-                summary["errors"] += 1
-                self.stdout.write(self.style.WARNING(f"Produit ignore ({product_data.get('sku')}): {exc}"))
+        with _download_feed(source_url, timeout) as feed:
+            items = _feed_items(feed)
+            if options["limit"]:
+                items = islice(items, int(options["limit"]))
+            # Prompt commun construit une fois ; reconstruit seulement apres une creation.
+            prompt_prefix = None
+            while chunk := list(islice(items, BATCH_SIZE)):
+                prompt_prefix = self._process_chunk(
+                    chunk,
+                    generator,
+                    prompt_prefix,
+                    options["ai_only_missing"],
+                    options["dry_run"],
+                    summary,
+                )
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -134,12 +244,87 @@ class Command(BaseCommand):
             )
         )
 
-    def _process_product(self, product_data: dict, generator, dry_run: bool, summary: dict) -> None:
+    def _process_chunk(
+        self,
+        chunk: list,
+        generator,
+        prompt_prefix: str | None,
+        ai_only_missing: bool,
+        dry_run: bool,
+        summary: dict,
+    ) -> str | None:
+        # Produits locaux charges en une requete ; ecritures groupees par lot.
+        product_by_sku: dict[str, Product] = {}
+        if not dry_run:
+            skus = {_clean(item.get("sku")) for item in chunk if isinstance(item, dict)}
+            skus.discard("")
+            product_by_sku = Product.objects.in_bulk(list(skus), field_name="sku")
+        to_update: dict[int, Product] = {}
+
+        for product_data in chunk:
+            summary["processed"] += 1
+            if generator and prompt_prefix is None:
+                prompt_prefix = _build_prompt_prefix(_format_taxonomy())
+            try:
+                if self._process_product(
+                    product_data,
+                    generator,
+                    prompt_prefix,
+                    product_by_sku,
+                    to_update,
+                    ai_only_missing,
+                    dry_run,
+                    summary,
+                ):
+                    prompt_prefix = None
+            except Exception as exc:  # noqa: BLE001
+                summary["errors"] += 1
+                self.stdout.write(self.style.WARNING(f"Produit ignore ({product_data.get('sku')}): {exc}"))
+
+        if to_update:
+            self._save_products(list(to_update.values()), summary)
+        return prompt_prefix
+
+    def _save_products(self, updated: list[Product], summary: dict) -> None:
+        # bulk_update ignore auto_now : updated_at est renseigne ici.
+        now = timezone.now()
+        for product in updated:
+            product.updated_at = now
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_update(updated, PRODUCT_UPDATE_FIELDS, batch_size=BATCH_SIZE)
+                Version.record_many(updated, Version.Action.UPDATE)
+        except DatabaseError:
+            # Lot refuse : chaque produit est rejoue seul pour isoler le fautif.
+            for product in updated:
+                try:
+                    with transaction.atomic():
+                        product.save(update_fields=PRODUCT_UPDATE_FIELDS)
+                except Exception as exc:  # noqa: BLE001
+                    summary["errors"] += 1
+                    summary["products_updated"] -= 1
+                    self.stdout.write(
+                        self.style.WARNING(f"Produit non mis a jour ({product.sku}): {exc}")
+                    )
+
+    def _process_product(
+        self,
+        product_data: dict,
+        generator,
+        prompt_prefix: str | None,
+        product_by_sku: dict[str, Product],
+        to_update: dict[int, Product],
+        ai_only_missing: bool,
+        dry_run: bool,
+        summary: dict,
+    ) -> bool:
+        """Classe un produit distant ; renvoie True si la taxonomie a change."""
         category_name = _clean(product_data.get("category"))
         subcategory_name = _clean(product_data.get("subcategory"))
 
-        if generator:
-            prompt = _build_prompt(product_data, list(Category.objects.prefetch_related("subcategories").all()))
+        # Un appel Mistral prend des secondes : inutile si le flux classe deja le produit.
+        if generator and not (ai_only_missing and category_name and subcategory_name):
+            prompt = _build_prompt(product_data, prompt_prefix)
             answer = generator.generate_text(prompt, temperature=0.1, max_tokens=140)
             suggestion = _parse_response(answer or "")
             if suggestion:
@@ -147,7 +332,7 @@ class Command(BaseCommand):
                 subcategory_name = suggestion.subcategory or ""
 
         if not category_name:
-            return
+            return False
 
         with transaction.atomic():
             category, created_category = Category.objects.get_or_create(name=category_name)
@@ -155,6 +340,7 @@ class Command(BaseCommand):
                 summary["categories_created"] += 1
 
             subcategory = None
+            created_sub = False
             if subcategory_name:
                 subcategory, created_sub = SubCategory.objects.get_or_create(
                     category=category,
@@ -163,20 +349,23 @@ class Command(BaseCommand):
                 if created_sub:
                     summary["subcategories_created"] += 1
 
-            sku = _clean(product_data.get("sku"))
-            if not sku or dry_run:
-                return
-
-            product = Product.objects.filter(sku=sku).first()
-            if not product:
-                return
-            updates = []
-            if product.category_id != category.id:
-                product.category = category
-                updates.append("category")
-            if (product.subcategory_id or None) != (subcategory.id if subcategory else None):
-                product.subcategory = subcategory
-                updates.append("subcategory")
-            if updates:
-                product.save(update_fields=updates)
-                summary["products_updated"] += 1
+        taxonomy_changed = created_category or created_sub
+
+        sku = _clean(product_data.get("sku"))
+        if not sku or dry_run:
+            return taxonomy_changed
+
+        product = product_by_sku.get(sku)
+        if not product:
+            return taxonomy_changed
+        changed = False
+        if product.category_id != category.id:
+            product.category = category
+            changed = True
+        if (product.subcategory_id or None) != (subcategory.id if subcategory else None):
+            product.subcategory = subcategory
+            changed = True
+        if changed:
+            to_update[product.pk] = product
+            summary["products_updated"] += 1
+        return taxonomy_changed
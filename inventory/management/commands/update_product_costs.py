@@ -6,8 +6,10 @@ from pathlib import Path
 from typing import Iterable, Sequence
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 
-from inventory.models import Product
+from inventory.models import Product, Version
 
 try:  # pragma: no cover
     from openpyxl import load_workbook
@@ -15,6 +17,14 @@ except ImportError:  # pragma: no cover
     load_workbook = None  # type: ignore[assignment]
 
 
+BATCH_SIZE = 500
+UPDATE_FIELDS = ["purchase_price", "updated_at"]
+# Tout sauf chiffres, signe et separateurs : devises, espaces, libelles.
+_COST_STRIP_RE = re.compile(r"[^\d\-,\.]")
+# "1.234,56" -> "1234.56" ; "12,5" -> "12.5".
+_THOUSANDS_DOT = str.maketrans({".": None, ",": "."})
+_DECIMAL_COMMA = str.maketrans({",": "."})
+
 DEFAULT_REFERENCE_HEADERS = (
     "référence interne",
     "reference interne",
@@ -119,8 +129,8 @@ def _normalize_reference(value: object | None) -> str:
 
 
 def _parse_decimal_value(raw_value: object | None) -> Decimal | None:
-    if raw_value is None:
-        return None
+    # openpyxl (data_only=True) renvoie des nombres natifs : aucun travail sur
+    # les chaines dans le cas courant.
     if isinstance(raw_value, Decimal):
         return raw_value
     if isinstance(raw_value, (int, float)):
@@ -128,20 +138,19 @@ def _parse_decimal_value(raw_value: object | None) -> Decimal | None:
             return Decimal(str(raw_value))
         except InvalidOperation:
             return None
-    text = str(raw_value).strip()
-    if not text:
+    if raw_value is None:
         return None
-    text = re.sub(r"[^\d\-,\.]", "", text)
+    text = _COST_STRIP_RE.sub("", str(raw_value))
     if not text:
         return None
-    if "," in text and "." in text:
-        text = text.replace(".", "")
-        text = text.replace(",", ".")
-    elif "," in text:
-        text = text.replace(",", ".")
-    elif "." in text:
+    has_comma, has_dot = "," in text, "." in text
+    if has_comma and has_dot:
+        text = text.translate(_THOUSANDS_DOT)
+    elif has_comma:
+        text = text.translate(_DECIMAL_COMMA)
+    elif has_dot:
         parts = text.split(".")
-        if len(parts) > 1 and len(parts[-1]) == 3:
+        if len(parts[-1]) == 3:
             text = "".join(parts)
     try:
         return Decimal(text)
@@ -149,6 +158,34 @@ def _parse_decimal_value(raw_value: object | None) -> Decimal | None:
         return None
 
 
+def _products_by_reference(
+    match_field: str, references: Iterable[str]
+) -> dict[str, dict[int, Product]]:
+    """Products matching ``references`` case-insensitively, keyed by casefolded value.
+
+    Several products under one key make the reference ambiguous, as with the
+    former ``iexact`` lookup.
+    """
+    wanted = {reference.casefold() for reference in references}
+    if not wanted:
+        return {}
+    # Comparaison insensible a la casse faite en Python : une seule lecture
+    # etroite (pk, reference) au lieu de LOWER() cote base a chaque lot.
+    pks_by_key: dict[str, list[int]] = {}
+    values = Product.objects.values_list("pk", match_field).order_by()
+    for pk, value in values.iterator(chunk_size=2000):
+        if not value:
+            continue
+        key = value.casefold()
+        if key in wanted:
+            pks_by_key.setdefault(key, []).append(pk)
+    products = Product.objects.in_bulk([pk for pks in pks_by_key.values() for pk in pks])
+    return {
+        key: {pk: products[pk] for pk in pks if pk in products}
+        for key, pks in pks_by_key.items()
+    }
+
+
 class Command(BaseCommand):
     help = "Met à jour le prix d'achat des produits à partir d'un fichier Excel."
 
@@ -199,7 +236,9 @@ class Command(BaseCommand):
 
         workbook = load_workbook(file_path, data_only=True, read_only=True)
         sheet = _select_sheet(workbook, options.get("sheet"))
-        header_row = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+        # Une seule passe sur la feuille : l'en-tete puis les lignes.
+        sheet_rows = sheet.values
+        header_row = next(sheet_rows, ())
         if not header_row:
             raise CommandError("Impossible de lire l'en-tête du fichier Excel.")
 
@@ -218,45 +257,77 @@ class Command(BaseCommand):
             "not_found": 0,
             "ambiguous": 0,
         }
-        errors: list[str] = []
+        errors: list[tuple[int, str]] = []
         match_field = options["match_field"]
 
-        for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+        # Passe 1 : lignes valides gardees en memoire, sans requete.
+        rows: list[tuple[int, str, Decimal]] = []
+        for row_number, row in enumerate(sheet_rows, start=2):
             summary["rows"] += 1
-            reference_value = _normalize_reference(_get_cell_value(row, reference_idx))
+            # En lecture seule les lignes sont des tuples de largeur fixe ;
+            # seules les lignes tronquees passent par _get_cell_value.
+            try:
+                reference_raw = row[reference_idx]
+                cost_raw = row[cost_idx]
+            except IndexError:
+                reference_raw = _get_cell_value(row, reference_idx)
+                cost_raw = _get_cell_value(row, cost_idx)
+            if isinstance(reference_raw, str):
+                reference_value = reference_raw.strip()
+            else:
+                reference_value = _normalize_reference(reference_raw)
             if not reference_value:
                 summary["missing_reference"] += 1
-                errors.append(f"Ligne {row_number}: référence manquante.")
+                errors.append((row_number, f"Ligne {row_number}: référence manquante."))
                 continue
 
-            cost_value = _parse_decimal_value(_get_cell_value(row, cost_idx))
+            cost_value = _parse_decimal_value(cost_raw)
             if cost_value is None:
-                raw = _get_cell_value(row, cost_idx)
                 summary["invalid_cost"] += 1
-                errors.append(f"Ligne {row_number}: coût invalide '{raw}'.")
+                errors.append((row_number, f"Ligne {row_number}: coût invalide '{cost_raw}'."))
                 continue
+            rows.append((row_number, reference_value, cost_value))
 
-            lookup = {f"{match_field}__iexact": reference_value}
-            products = Product.objects.filter(**lookup)
-            count = products.count()
-            if count == 0:
+        # Passe 2 : produits charges par lots, mises a jour groupees.
+        products_by_reference = _products_by_reference(
+            match_field, (reference_value for _, reference_value, _ in rows)
+        )
+        to_update: dict[int, Product] = {}
+        for row_number, reference_value, cost_value in rows:
+            products = products_by_reference.get(reference_value.casefold(), {})
+            if not products:
                 summary["not_found"] += 1
-                errors.append(f"Ligne {row_number}: référence '{reference_value}' introuvable.")
+                errors.append(
+                    (row_number, f"Ligne {row_number}: référence '{reference_value}' introuvable.")
+                )
                 continue
-            if count > 1:
+            if len(products) > 1:
                 summary["ambiguous"] += 1
                 errors.append(
-                    f"Ligne {row_number}: plusieurs produits correspondent à '{reference_value}'."
+                    (
+                        row_number,
+                        f"Ligne {row_number}: plusieurs produits correspondent à '{reference_value}'.",
+                    )
                 )
                 continue
 
-            product = products.first()
+            product = next(iter(products.values()))
             if product.purchase_price == cost_value:
                 continue
             product.purchase_price = cost_value
-            product.save(update_fields=["purchase_price", "updated_at"])
+            to_update[product.pk] = product
             summary["updated"] += 1
 
+        if to_update:
+            updated = list(to_update.values())
+            # bulk_update ignore auto_now : updated_at est renseigne ici.
+            now = timezone.now()
+            for product in updated:
+                product.updated_at = now
+            with transaction.atomic():
+                Product.objects.bulk_update(updated, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+                Version.record_many(updated, Version.Action.UPDATE)
+
         self.stdout.write(
             self.style.SUCCESS(
                 "Fichier traité (%(rows)d lignes) : %(updated)d produits mis à jour, "
@@ -267,5 +338,4 @@ class Command(BaseCommand):
         )
         if errors:
             self.stdout.write(self.style.WARNING("Détails des lignes ignorées :"))
-            for error in errors:
-                self.stdout.write(f"- {error}")
+            self.stdout.write("\n".join(f"- {error}" for _, error in sorted(errors)))
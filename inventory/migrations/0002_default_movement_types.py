@@ -11,11 +11,11 @@ def create_default_movement_types(apps, schema_editor):
         ("Ajustement positif", "AJUSTEMENT_PLUS", "IN"),
         ("Ajustement négatif", "AJUSTEMENT_MOINS", "OUT"),
     ]
-    for name, code, direction in defaults:
-        MovementType.objects.get_or_create(
-            code=code,
-            defaults={'name': name, 'direction': direction},
-        )
+    # Un seul INSERT ; les codes deja presents sont laisses tels quels.
+    MovementType.objects.bulk_create(
+        [MovementType(code=code, name=name, direction=direction) for name, code, direction in defaults],
+        ignore_conflicts=True,
+    )
 
 
 def reverse_movement_types(apps, schema_editor):
@@ -6,11 +6,11 @@ def _create_initial_sites(apps, schema_editor):
     Site = apps.get_model("inventory", "Site")
     StockMovement = apps.get_model("inventory", "StockMovement")
     names = ["Treichville", "Riviera 2", "Abobo"]
-    created_sites = []
-    for name in names:
-        site, _ = Site.objects.get_or_create(name=name, defaults={"description": ""})
-        created_sites.append(site)
-    default_site = created_sites[0] if created_sites else None
+    Site.objects.bulk_create(
+        [Site(name=name, description="") for name in names],
+        ignore_conflicts=True,
+    )
+    default_site = Site.objects.in_bulk(names[:1], field_name="name").get(names[0])
     if default_site:
         StockMovement.objects.filter(site__isnull=True).update(site=default_site)
 
@@ -33,31 +33,72 @@ def create_initial_users(apps, schema_editor):
         },
     ]
 
+    # Requetes groupees : quelques allers-retours au lieu de cinq par utilisateur.
+    Site.objects.bulk_create(
+        [Site(name=entry["site_name"], description=entry["site_description"]) for entry in users],
+        ignore_conflicts=True,
+    )
+    sites_by_name = Site.objects.in_bulk([entry["site_name"] for entry in users], field_name="name")
+
+    usernames = [entry["username"] for entry in users]
+    existing = User.objects.in_bulk(usernames, field_name="username")
+    hashed_password = None
+    to_create = []
+    to_update = []
     for entry in users:
-        site, _ = Site.objects.get_or_create(
-            name=entry["site_name"],
-            defaults={"description": entry["site_description"]},
-        )
-        user, created = User.objects.get_or_create(
-            username=entry["username"],
-            defaults={
-                "first_name": entry["first_name"],
-                "last_name": entry["last_name"],
-            },
-        )
-        update_fields = []
+        user = existing.get(entry["username"])
+        if user is None or not user.password:
+            # PBKDF2 est volontairement lent : un seul hachage pour tous.
+            hashed_password = hashed_password or make_password(default_password)
+        if user is None:
+            to_create.append(
+                User(
+                    username=entry["username"],
+                    first_name=entry["first_name"],
+                    last_name=entry["last_name"],
+                    password=hashed_password,
+                )
+            )
+            continue
+        changed = False
         if user.first_name != entry["first_name"]:
             user.first_name = entry["first_name"]
-            update_fields.append("first_name")
+            changed = True
         if user.last_name != entry["last_name"]:
             user.last_name = entry["last_name"]
-            update_fields.append("last_name")
-        if created or not user.password:
-            user.password = make_password(default_password)
-            update_fields.append("password")
-        if update_fields:
-            user.save(update_fields=update_fields)
-        SiteAssignment.objects.update_or_create(user=user, defaults={"site": site})
+            changed = True
+        if not user.password:
+            user.password = hashed_password
+            changed = True
+        if changed:
+            to_update.append(user)
+    if to_create:
+        User.objects.bulk_create(to_create)
+    if to_update:
+        User.objects.bulk_update(to_update, ["first_name", "last_name", "password"])
+
+    users_by_name = User.objects.in_bulk(usernames, field_name="username")
+    assignments = {
+        assignment.user_id: assignment
+        for assignment in SiteAssignment.objects.filter(
+            user_id__in=[user.pk for user in users_by_name.values()]
+        )
+    }
+    new_assignments = []
+    moved_assignments = []
+    for entry in users:
+        user = users_by_name[entry["username"]]
+        site = sites_by_name[entry["site_name"]]
+        assignment = assignments.get(user.pk)
+        if assignment is None:
+            new_assignments.append(SiteAssignment(user=user, site=site))
+        elif assignment.site_id != site.pk:
+            assignment.site = site
+            moved_assignments.append(assignment)
+    if new_assignments:
+        SiteAssignment.objects.bulk_create(new_assignments)
+    if moved_assignments:
+        SiteAssignment.objects.bulk_update(moved_assignments, ["site"])
 
 
 def remove_initial_users(apps, schema_editor):
@@ -7,6 +7,15 @@ def ensure_manual_types(apps, schema_editor):
         ("Réception", "RECEPTION", "IN"),
         ("Transfert", "TRANSFERT", "OUT"),
     ]
+    if schema_editor.connection.features.supports_update_conflicts_with_target:
+        # Un seul INSERT ... ON CONFLICT (code) DO UPDATE.
+        MovementType.objects.bulk_create(
+            [MovementType(code=code, name=name, direction=direction) for name, code, direction in defaults],
+            update_conflicts=True,
+            unique_fields=["code"],
+            update_fields=["name", "direction", "updated_at"],
+        )
+        return
     for name, code, direction in defaults:
         MovementType.objects.update_or_create(
             code=code,
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-16 21:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("inventory", "0030_cancel_stale_inventory_sessions"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="stockmovement",
+            name="movement_date",
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="stockmovement",
+            index=models.Index(fields=["product", "-movement_date"], name="sm_prod_date_idx"),
+        ),
+    ]
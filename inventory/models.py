@@ -51,6 +51,15 @@ class Version(TimeStampedModel):
 
     @classmethod
     def record(cls, instance, action, user=None):
+        cls._build(instance, action, user).save()
+
+    @classmethod
+    def record_many(cls, instances, action, user=None):
+        """Record one version per instance for rows written with ``bulk_update``."""
+        cls.objects.bulk_create([cls._build(instance, action, user) for instance in instances])
+
+    @classmethod
+    def _build(cls, instance, action, user=None):
         snapshot = model_to_dict(instance)
         for key, value in snapshot.items():
             if isinstance(value, FieldFile):
@@ -62,7 +71,7 @@ class Version(TimeStampedModel):
                 object_url = instance.get_absolute_url()
             except Exception:
                 object_url = ""
-        cls.objects.create(
+        return cls(
             content_type=content_type,
             object_id=str(instance.pk),
             user=user,
@@ -643,7 +652,7 @@ class StockMovement(VersionedModelMixin, TimeStampedModel):
         related_name="stock_movements",
     )
     quantity = models.PositiveIntegerField()
-    movement_date = models.DateTimeField(default=timezone.now)
+    movement_date = models.DateTimeField(default=timezone.now, db_index=True)
     performed_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.SET_NULL,
@@ -658,6 +667,7 @@ class StockMovement(VersionedModelMixin, TimeStampedModel):
 
     class Meta:
         ordering = ["-movement_date", "-id"]
+        indexes = [models.Index(fields=["product", "-movement_date"], name="sm_prod_date_idx")]
         verbose_name = "mouvement de stock"
         verbose_name_plural = "mouvements de stock"
 
@@ -892,6 +902,28 @@ class Sale(VersionedModelMixin, TimeStampedModel):
     def __str__(self) -> str:
         return f"Vente {self.reference}"
 
+    def items_for_edit_form(self):
+        """Lines of the sale with only the columns the line formset needs."""
+        return (
+            self.items.select_related("product")
+            .only(
+                "id",
+                "sale",
+                "line_type",
+                "product",
+                "quantity",
+                "unit_price",
+                "scan_code",
+                "description",
+                "position",
+                "product__id",
+                "product__sku",
+                "product__name",
+                "product__sale_price",
+            )
+            .order_by("position", "id")
+        )
+
     @property
     def customer_display_name(self) -> str:
         if self.customer:
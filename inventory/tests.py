@@ -1,18 +1,41 @@
+import hashlib
+import json
+import tempfile
 from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
 from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
+from openpyxl import Workbook
 from PIL import Image
 
 from .bot import ProductAssetBot
+from .forms import (
+    InventoryAdjustmentForm,
+    MovementHeaderForm,
+    MovementLineForm,
+    SaleForm,
+    SaleItemFormSet,
+)
 from .category_auto import _pick_best_rule, Rule, run_auto_assign_categories
-from .datasheets import DatasheetSummary, fetch_hikvision_datasheets, search_datasheet_pdf
+from .datasheets import (
+    DatasheetSummary,
+    _UrlCache,
+    HostRateLimiter,
+    download_pdf_streaming,
+    fetch_hikvision_datasheets,
+    rank_pdf_candidates,
+    search_datasheet_pdf,
+)
 from .models import (
     Brand,
     Category,
@@ -27,6 +50,7 @@ from .models import (
     SiteAssignment,
     StockMovement,
     SubCategory,
+    Version,
 )
 
 
@@ -671,6 +695,26 @@ class SalesWorkflowTests(TestCase):
         )
         self.client.force_login(self.user)
 
+    def test_items_for_edit_form_loads_products_with_lines(self):
+        sale = Sale.objects.create(
+            reference="VENTE-EDIT",
+            sale_date=timezone.now(),
+            customer_name="ACME",
+        )
+        for position in range(3):
+            SaleItem.objects.create(
+                sale=sale,
+                product=self.product,
+                quantity=1,
+                unit_price=Decimal("120.00"),
+                position=position,
+            )
+
+        with self.assertNumQueries(1):
+            names = [item.product.name for item in sale.items_for_edit_form()]
+
+        self.assertEqual(names, ["Switch manageable"] * 3)
+
     def test_sale_confirmation_creates_exit_movements(self):
         sale = Sale.objects.create(
             reference="VENTE-100",
@@ -698,6 +742,42 @@ class SalesWorkflowTests(TestCase):
         )
         self.assertEqual(self.product.stock_quantity, 15)
 
+    def test_sale_return_rejects_lines_from_another_sale(self):
+        sale = Sale.objects.create(
+            reference="VENTE-RET",
+            sale_date=timezone.now(),
+            customer_name="ACME",
+        )
+        item = SaleItem.objects.create(
+            sale=sale,
+            product=self.product,
+            quantity=4,
+            unit_price=Decimal("120.00"),
+        )
+        sale.confirm(site=self.site)
+        payload = {
+            "returns-TOTAL_FORMS": "1",
+            "returns-INITIAL_FORMS": "1",
+            "returns-MIN_NUM_FORMS": "0",
+            "returns-MAX_NUM_FORMS": "1000",
+            "returns-0-sale_item_id": str(item.pk + 1000),
+            "returns-0-return_quantity": "1",
+        }
+
+        response = self.client.post(reverse("inventory:sale_return", args=[sale.pk]), data=payload)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Ligne invalide.", response.context["formset"].forms[0].non_field_errors())
+        item.refresh_from_db()
+        self.assertEqual(item.returned_quantity, 0)
+
+        payload["returns-0-sale_item_id"] = str(item.pk)
+        response = self.client.post(reverse("inventory:sale_return", args=[sale.pk]), data=payload)
+
+        self.assertRedirects(response, reverse("inventory:sales_list"))
+        item.refresh_from_db()
+        self.assertEqual(item.returned_quantity, 1)
+
     def test_sale_create_view_records_sale_and_stock(self):
         user = self.user
         self.client.force_login(user)
@@ -1048,6 +1128,148 @@ class ProductBotViewTests(TestCase):
         self.assertEqual(kwargs["queryset"], [self.product])
 
 
+class ReferenceChoicesCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.site = Site.objects.create(name="Depot")
+
+    def test_site_choices_are_reused_between_forms(self):
+        str(InventoryAdjustmentForm()["site"])
+
+        with self.assertNumQueries(0):
+            rendered = str(InventoryAdjustmentForm()["site"])
+
+        self.assertIn("Depot", rendered)
+
+    def test_site_removed_elsewhere_is_rejected_despite_cache(self):
+        str(InventoryAdjustmentForm()["site"])
+        # Suppression sans signal, comme depuis un autre processus.
+        Site.objects.filter(pk=self.site.pk)._raw_delete(Site.objects.db)
+        form = InventoryAdjustmentForm({"site": str(self.site.pk), "counted_quantity": "3"})
+
+        self.assertFalse(form.is_valid())
+        self.assertIn("site", form.errors)
+
+    def test_site_created_elsewhere_is_accepted_for_unrestricted_user(self):
+        user = get_user_model().objects.create_superuser(username="root", password="password123")
+        str(MovementHeaderForm(user=user)["site"])
+        # Creation sans signal : le cache des sites ne la voit pas.
+        Site.objects.bulk_create([Site(name="Annexe")])
+        annexe = Site.objects.get(name="Annexe")
+        movement_type = MovementType.objects.create(
+            name="Reception", code="RECEPTION_CACHE", direction=MovementType.MovementDirection.ENTRY
+        )
+        form = MovementHeaderForm(
+            {
+                "movement_type": str(movement_type.pk),
+                "movement_date": "2024-01-01T10:00",
+                "site": str(annexe.pk),
+            },
+            user=user,
+        )
+
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data["site"], annexe)
+
+    def test_customer_choices_are_cached_and_refreshed(self):
+        Customer.objects.create(reference="CL-1", name="Awa")
+        str(SaleForm()["customer"])
+
+        with self.assertNumQueries(0):
+            rendered = str(SaleForm()["customer"])
+        self.assertIn("Awa", rendered)
+
+        Customer.objects.create(reference="CL-2", name="Moussa")
+        self.assertIn("Moussa", str(SaleForm()["customer"]))
+
+    def test_site_choices_are_refreshed_after_site_change(self):
+        str(InventoryAdjustmentForm()["site"])
+        Site.objects.create(name="Annexe")
+
+        rendered = str(InventoryAdjustmentForm()["site"])
+
+        self.assertIn("Annexe", rendered)
+
+
+class ProductAutocompleteTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Hikvision")
+        category = Category.objects.create(name="Cameras")
+        self.camera = Product.objects.create(
+            sku="DS-2CD", name="Camera dome", brand=brand, category=category
+        )
+        self.recorder = Product.objects.create(
+            sku="DS-7604", name="Enregistreur", brand=brand, category=category
+        )
+        self.user = get_user_model().objects.create_user(username="picker", password="password123")
+
+    def test_widget_renders_only_selected_product(self):
+        rendered = str(MovementLineForm(initial={"product": self.camera})["product"])
+
+        self.assertIn("Camera dome", rendered)
+        self.assertNotIn("Enregistreur", rendered)
+
+
+class SaleItemFormSetScanTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Dahua")
+        category = Category.objects.create(name="Cameras")
+        self.camera = Product.objects.create(
+            sku="IPC-HDW", name="Camera", barcode="1234567890", brand=brand, category=category
+        )
+        self.switch = Product.objects.create(
+            sku="PFS3010", name="Switch", brand=brand, category=category
+        )
+
+    def _formset(self, codes):
+        data = {
+            "items-TOTAL_FORMS": str(len(codes)),
+            "items-INITIAL_FORMS": "0",
+            "items-MIN_NUM_FORMS": "1",
+            "items-MAX_NUM_FORMS": "1000",
+        }
+        for index, code in enumerate(codes):
+            data[f"items-{index}-line_type"] = SaleItem.LineType.PRODUCT
+            data[f"items-{index}-quantity"] = "1"
+            data[f"items-{index}-scan_code"] = code
+        return SaleItemFormSet(data, prefix="items")
+
+    def test_scan_codes_are_resolved_in_one_query(self):
+        formset = self._formset(["1234567890", "pfs3010"])
+
+        with self.assertNumQueries(1):
+            self.assertTrue(formset.is_valid())
+
+        products = [form.cleaned_data["product"] for form in formset.forms]
+        self.assertEqual(products, [self.camera, self.switch])
+
+    def test_submitted_products_are_loaded_once_for_all_lines(self):
+        data = {
+            "items-TOTAL_FORMS": "3",
+            "items-INITIAL_FORMS": "0",
+            "items-MIN_NUM_FORMS": "1",
+            "items-MAX_NUM_FORMS": "1000",
+        }
+        for index, product in enumerate([self.camera, self.switch, self.camera]):
+            data[f"items-{index}-line_type"] = SaleItem.LineType.PRODUCT
+            data[f"items-{index}-quantity"] = "1"
+            data[f"items-{index}-product"] = str(product.pk)
+
+        with self.assertNumQueries(1):
+            formset = SaleItemFormSet(data, prefix="items")
+            self.assertTrue(formset.is_valid())
+
+        products = [form.cleaned_data["product"] for form in formset.forms]
+        self.assertEqual(products, [self.camera, self.switch, self.camera])
+
+    def test_unknown_scan_code_is_reported_on_its_line(self):
+        formset = self._formset(["1234567890", "UNKNOWN"])
+
+        self.assertFalse(formset.is_valid())
+        self.assertIn("UNKNOWN", str(formset.forms[1].non_field_errors()))
+        self.assertFalse(formset.forms[0].errors)
+
+
 class DatasheetSearchTests(TestCase):
     @override_settings(SERPER_API_KEY="serper-key")
     @patch("inventory.datasheets.google_cse_search")
@@ -1099,6 +1321,158 @@ class DatasheetSearchTests(TestCase):
         self.assertEqual(source, "google_cse")
         self.assertIn("DS-2CD.pdf", best)
 
+    @patch("inventory.datasheets.serper_search")
+    def test_search_datasheet_pdf_verify_skips_candidates_not_served_as_pdf(self, serper_mock):
+        serper_mock.return_value = {
+            "organic": [
+                {
+                    "link": "https://www.hikvision.com/fr/DS-2CD-datasheet.pdf",
+                    "title": "DS-2CD datasheet",
+                    "snippet": "fiche technique",
+                },
+                {
+                    "link": "https://cdn.example.com/DS-2CD.pdf",
+                    "title": "DS-2CD",
+                    "snippet": "",
+                },
+            ]
+        }
+        landing = MagicMock(url="https://www.hikvision.com/fr/landing", headers={"Content-Type": "text/html"})
+        pdf = MagicMock(url="https://cdn.example.com/DS-2CD.pdf", headers={"Content-Type": "application/pdf"})
+        session = MagicMock()
+        session.head.side_effect = [landing, pdf]
+
+        best, source = search_datasheet_pdf(
+            session=session,
+            query='site:hikvision.com "DS-2CD" filetype:pdf',
+            model="DS-2CD",
+            verify=True,
+        )
+
+        self.assertEqual(source, "serper")
+        self.assertEqual(best, "https://cdn.example.com/DS-2CD.pdf")
+        self.assertEqual(session.head.call_count, 2)
+
+    @patch("inventory.datasheets.serper_search")
+    def test_search_datasheet_pdf_verify_skips_dead_pdf_links(self, serper_mock):
+        serper_mock.return_value = {
+            "organic": [
+                {
+                    "link": "https://www.hikvision.com/fr/DS-2CD-datasheet.pdf",
+                    "title": "DS-2CD datasheet",
+                    "snippet": "fiche technique",
+                },
+                {
+                    "link": "https://cdn.example.com/DS-2CD.pdf",
+                    "title": "DS-2CD",
+                    "snippet": "",
+                },
+            ]
+        }
+        missing = MagicMock(
+            url="https://www.hikvision.com/fr/DS-2CD-datasheet.pdf",
+            headers={"Content-Type": "application/pdf"},
+            status_code=404,
+            ok=False,
+        )
+        pdf = MagicMock(
+            url="https://cdn.example.com/DS-2CD.pdf",
+            headers={"Content-Type": "application/pdf"},
+            status_code=200,
+            ok=True,
+        )
+        session = MagicMock()
+        session.head.side_effect = [missing, pdf]
+
+        best, _ = search_datasheet_pdf(
+            session=session,
+            query='site:hikvision.com "DS-2CD" filetype:pdf',
+            model="DS-2CD",
+            verify=True,
+        )
+
+        self.assertEqual(best, "https://cdn.example.com/DS-2CD.pdf")
+
+    def test_rank_pdf_candidates_ignores_pdf_inside_path(self):
+        ranked = rank_pdf_candidates(
+            [
+                {"link": "https://example.com/DS-2CD.pdf.html", "title": "DS-2CD"},
+                {"link": "https://example.com/DS-2CD.pdf", "title": "DS-2CD"},
+            ],
+            "DS-2CD",
+        )
+
+        self.assertEqual(ranked[0], "https://example.com/DS-2CD.pdf")
+
+
+class HostRateLimiterTests(TestCase):
+    @patch("inventory.datasheets.time.sleep")
+    def test_calls_are_spaced_per_host(self, sleep_mock):
+        limiter = HostRateLimiter()
+
+        limiter.acquire("google.serper.dev", 2)
+        limiter.acquire("www.googleapis.com", 2)
+        sleep_mock.assert_not_called()
+
+        limiter.acquire("google.serper.dev", 2)
+        sleep_mock.assert_called_once()
+        self.assertAlmostEqual(sleep_mock.call_args.args[0], 0.5, delta=0.1)
+
+
+class DatasheetDownloadTests(TestCase):
+    @staticmethod
+    def _response(url, content_type, chunks):
+        response = MagicMock()
+        response.url = url
+        response.headers = {"Content-Type": content_type}
+        response.raise_for_status.return_value = None
+        response.iter_content.return_value = chunks
+        return response
+
+    def test_pdf_body_is_returned_as_rewound_file(self):
+        session = MagicMock()
+        session.get.return_value = self._response(
+            "https://example.com/a.pdf", "application/pdf", [b"%PDF-1.4 ", b"body"]
+        )
+
+        final_url, pdf_file, sha256 = download_pdf_streaming(session, "https://example.com/a.pdf")
+
+        with pdf_file:
+            self.assertEqual(pdf_file.read(), b"%PDF-1.4 body")
+        self.assertEqual(final_url, "https://example.com/a.pdf")
+        self.assertEqual(sha256, hashlib.sha256(b"%PDF-1.4 body").hexdigest())
+
+    def test_html_page_follows_pdf_link(self):
+        session = MagicMock()
+        session.get.side_effect = [
+            self._response(
+                "https://example.com/page",
+                "text/html; charset=utf-8",
+                [b'<a href="/files/datasheet.pdf">Datasheet</a>'],
+            ),
+            self._response("https://example.com/files/datasheet.pdf", "application/pdf", [b"%PDF-1.7"]),
+        ]
+
+        final_url, pdf_file, _ = download_pdf_streaming(session, "https://example.com/page")
+
+        pdf_file.close()
+        self.assertEqual(final_url, "https://example.com/files/datasheet.pdf")
+        self.assertEqual(session.get.call_args_list[1].args[0], "https://example.com/files/datasheet.pdf")
+
+    def test_failed_shared_download_is_retried_by_next_bucket(self):
+        url_cache = _UrlCache()
+        url = "https://example.com/kit-series.pdf"
+        download = MagicMock(
+            side_effect=[RuntimeError("timeout"), (url, b"%PDF-kit", "same-hash")]
+        )
+
+        with self.assertRaises(RuntimeError):
+            url_cache.fetch(url, download)
+        self.assertEqual(url_cache.fetch(url, download), (url, b"%PDF-kit", "same-hash"))
+        # Le succes est ensuite partage sans nouveau telechargement.
+        self.assertEqual(url_cache.fetch(url, download), (url, None, "same-hash"))
+        self.assertEqual(download.call_count, 2)
+
 
 class DatasheetBatchFallbackTests(TestCase):
     def setUp(self):
@@ -1145,6 +1519,69 @@ class DatasheetBatchFallbackTests(TestCase):
         self.assertEqual(result.errors, [])
         self.assertEqual(search_mock.call_count, 3)
         self.assertEqual(download_mock.call_count, 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.datasheet_pdf.name.endswith(".pdf"))
+        self.assertTrue(second.datasheet_url.startswith("https://example.com/datasheet-"))
+        self.assertIsNotNone(second.datasheet_fetched_at)
+
+    @patch("inventory.datasheets.download_pdf_streaming")
+    @patch("inventory.datasheets.search_datasheet_pdf")
+    def test_models_resolving_to_same_url_download_once(self, search_mock, download_mock):
+        first = Product.objects.create(
+            sku="DS-KIS202T",
+            manufacturer_reference="DS-KIS202T",
+            name="Kit visiophone",
+            brand=self.brand,
+            category=self.category,
+        )
+        second = Product.objects.create(
+            sku="DS-KIS203T",
+            manufacturer_reference="DS-KIS203T",
+            name="Kit visiophone 2 fils",
+            brand=self.brand,
+            category=self.category,
+        )
+        search_mock.return_value = ("https://example.com/kit-series.pdf", "serper")
+        download_mock.return_value = ("https://example.com/kit-series.pdf", b"%PDF-kit", "same-hash")
+
+        result = fetch_hikvision_datasheets(queryset=[first, second], domain="hikvision.com")
+
+        self.assertEqual(result.updated, 2)
+        self.assertEqual(download_mock.call_count, 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.datasheet_pdf.name, second.datasheet_pdf.name)
+
+    @patch("inventory.datasheets.search_datasheet_pdf")
+    def test_existing_pdf_is_shared_within_model_bucket(self, search_mock):
+        with_pdf = Product.objects.create(
+            sku="DS-2CD1043G2-I-4MM",
+            manufacturer_reference="DS-2CD1043G2-I",
+            name="Camera bullet 4MP",
+            brand=self.brand,
+            category=self.category,
+            datasheet_pdf="products/datasheets/DS-2CD1043G2-I.pdf",
+            datasheet_url="https://example.com/DS-2CD1043G2-I.pdf",
+        )
+        without_pdf = Product.objects.create(
+            sku="DS-2CD1043G2-I-2MM",
+            manufacturer_reference="DS-2CD1043G2-I",
+            name="Camera bullet 4MP 2.8mm",
+            brand=self.brand,
+            category=self.category,
+        )
+
+        result = fetch_hikvision_datasheets(brand_name="Hikvision")
+
+        search_mock.assert_not_called()
+        self.assertEqual(result.products, 2)
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(result.skipped, 1)
+        without_pdf.refresh_from_db()
+        self.assertEqual(without_pdf.datasheet_pdf.name, with_pdf.datasheet_pdf.name)
+        self.assertEqual(without_pdf.datasheet_url, with_pdf.datasheet_url)
+        self.assertEqual(Version.for_instance(without_pdf).count(), 2)
 
 
 
@@ -1541,6 +1978,86 @@ class CategoryAutoAssignSingleProductTests(TestCase):
         self.assertEqual(self.switch_product.category, self.uncategorized)
 
 
+class CategoryAutoAssignBatchedAITests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Generique")
+        self.uncategorized = Category.objects.create(name="Non classe")
+        self.camera = Category.objects.create(name="Camera")
+        self.switch = Category.objects.create(name="Switch")
+        self.first = Product.objects.create(
+            sku="MYS-001",
+            name="Produit mystere alpha",
+            brand=self.brand,
+            category=self.uncategorized,
+        )
+        self.second = Product.objects.create(
+            sku="MYS-002",
+            name="Produit mystere beta",
+            brand=self.brand,
+            category=self.uncategorized,
+        )
+
+    @override_settings(MISTRAL_API_KEY="test-key")
+    @patch("inventory.category_auto._pick_best_rule", return_value=None)
+    @patch("inventory.category_auto.MistralTextGenerator")
+    def test_unmatched_products_share_one_ai_call(self, generator_cls, _rule_mock):
+        generator = generator_cls.return_value
+        generator.generate_text.return_value = (
+            '[{"id":1,"category":"Camera","subcategory":null},'
+            '{"id":2,"category":"Switch","subcategory":null}]'
+        )
+
+        result = run_auto_assign_categories(
+            rules_path=Path("missing_rules.json"),
+            use_ai=True,
+        )
+
+        self.assertEqual(generator.generate_text.call_count, 1)
+        self.assertEqual(result["ai_attempted"], 2)
+        self.assertEqual(result["ai_used"], 2)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.category, self.camera)
+        self.assertEqual(self.second.category, self.switch)
+
+    @override_settings(MISTRAL_API_KEY="test-key")
+    @patch("inventory.category_auto._pick_best_rule", return_value=None)
+    @patch("inventory.category_auto.MistralTextGenerator")
+    def test_unparseable_batch_falls_back_to_single_calls(self, generator_cls, _rule_mock):
+        generator = generator_cls.return_value
+        generator.generate_text.side_effect = [
+            "pas de json",
+            '{"category":"Camera","subcategory":null}',
+            '{"category":"Switch","subcategory":null}',
+        ]
+
+        result = run_auto_assign_categories(
+            rules_path=Path("missing_rules.json"),
+            use_ai=True,
+        )
+
+        self.assertEqual(generator.generate_text.call_count, 3)
+        self.assertEqual(result["ai_used"], 2)
+
+    @override_settings(MISTRAL_API_KEY="test-key")
+    @patch("inventory.category_auto._pick_best_rule", return_value=None)
+    @patch("inventory.category_auto.MistralTextGenerator")
+    def test_failed_batch_call_is_not_retried_per_product(self, generator_cls, _rule_mock):
+        generator = generator_cls.return_value
+        generator.generate_text.return_value = None
+
+        result = run_auto_assign_categories(
+            rules_path=Path("missing_rules.json"),
+            use_ai=True,
+        )
+
+        self.assertEqual(generator.generate_text.call_count, 1)
+        self.assertEqual(result["ai_attempted"], 2)
+        self.assertEqual(result["ai_used"], 0)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.category, self.uncategorized)
+
+
 class CategoryAutoAssignmentRuleTests(TestCase):
     def setUp(self):
         self.brand = Brand.objects.create(name="Hikvision")
@@ -2678,3 +3195,300 @@ class InventoryForceCloseTests(TestCase):
         ).get()
         self.assertEqual(adjustment.quantity, 1)
         self.assertContains(response, "dérogation responsable")
+
+
+def _write_workbook(path, rows):
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+class _ImportCommandTestCase(TestCase):
+    """Temporary folder for the import files and an existing product to update."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+        self.brand = Brand.objects.create(name="Hikvision")
+        self.category = Category.objects.create(name="Camera")
+        self.existing = Product.objects.create(
+            sku="CAM-01",
+            manufacturer_reference="CAM-01",
+            name="Camera dome",
+            brand=self.brand,
+            category=self.category,
+        )
+        # Code-barres deja en base : une ligne qui le reprend est refusee par
+        # la contrainte d'unicite.
+        self.holder = Product.objects.create(
+            sku="HOLD-01",
+            manufacturer_reference="HOLD-01",
+            name="Porteur du code-barres",
+            brand=self.brand,
+            category=self.category,
+            barcode="3000000000001",
+        )
+        self.old_timestamp = timezone.now() - timedelta(days=1)
+        Product.objects.filter(pk=self.existing.pk).update(updated_at=self.old_timestamp)
+
+    def _write_json(self, payload):
+        path = self.directory / "products.json"
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        return path
+
+    @staticmethod
+    def _versions(instance, action):
+        return Version.for_instance(instance).filter(action=action).count()
+
+
+class ImportRenderProductsCommandTests(_ImportCommandTestCase):
+    def setUp(self):
+        super().setUp()
+        Site.objects.create(name="Depot")
+        self.records = [
+            {
+                "default_code": "CAM-01",
+                "name": "Camera dome v2",
+                "brand": "Hikvision",
+                "category_main": "Camera",
+                "stock_quantity": 3,
+            },
+            {
+                "default_code": "NEW-01",
+                "name": "Switch PoE",
+                "brand": "Hikvision",
+                "category_main": "Camera",
+                "stock_quantity": 2,
+            },
+        ]
+
+    def _run(self, records):
+        output = StringIO()
+        call_command(
+            "import_render_products", "--file", str(self._write_json(records)), stdout=output
+        )
+        return output.getvalue()
+
+    def _assert_saved(self, output):
+        self.existing.refresh_from_db()
+        created = Product.objects.get(sku="NEW-01")
+        self.assertEqual(self.existing.name, "Camera dome v2")
+        self.assertGreater(self.existing.updated_at, self.old_timestamp)
+        self.assertEqual(self._versions(self.existing, Version.Action.UPDATE), 1)
+        self.assertEqual(self._versions(created, Version.Action.CREATE), 1)
+        self.assertEqual(StockMovement.objects.get(product=self.existing).quantity, 3)
+        self.assertEqual(StockMovement.objects.get(product=created).quantity, 2)
+        self.assertIn("produits créés: 1, mis à jour: 1", output)
+
+    def test_import_creates_and_updates_products_in_bulk(self):
+        output = self._run(self.records)
+
+        self._assert_saved(output)
+
+    def test_rejected_row_is_skipped_and_the_chunk_is_saved(self):
+        records = self.records + [
+            {"default_code": "NEW-02", "name": "Doublon", "barcode": "3000000000001", "stock_quantity": 5}
+        ]
+        # Code-barres pris entre la lecture des proprietaires et l'insertion.
+        with patch(
+            "inventory.management.commands.import_render_products._barcode_owners",
+            return_value={},
+        ):
+            output = self._run(records)
+
+        self._assert_saved(output)
+        self.assertFalse(Product.objects.filter(sku="NEW-02").exists())
+        self.assertEqual(StockMovement.objects.count(), 2)
+        self.assertIn("- NEW-02:", output)
+
+
+class ImportNewProductsCommandTests(_ImportCommandTestCase):
+    def _run(self, records):
+        output = StringIO()
+        call_command(
+            "import_new_products",
+            "--file",
+            str(self._write_json(records)),
+            "--skip-images",
+            stdout=output,
+        )
+        return output.getvalue()
+
+    def test_only_new_products_are_created(self):
+        output = self._run(
+            [
+                {"default_code": "CAM-01", "name": "Nom ignore"},
+                {"default_code": "NEW-01", "name": "Switch PoE", "brand": "Hikvision"},
+            ]
+        )
+
+        created = Product.objects.get(sku="NEW-01")
+        self.assertEqual(created.name, "Switch PoE")
+        self.assertEqual(self._versions(created, Version.Action.CREATE), 1)
+        # La commande ne met jamais a jour les produits existants.
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.name, "Camera dome")
+        self.assertEqual(self.existing.updated_at, self.old_timestamp)
+        self.assertEqual(self._versions(self.existing, Version.Action.UPDATE), 0)
+        self.assertIn("nouveaux produits: 1, deja presents: 1", output)
+
+    def test_rejected_row_is_skipped_and_the_batch_is_saved(self):
+        with patch(
+            "inventory.management.commands.import_new_products._barcode_owners",
+            return_value={},
+        ):
+            output = self._run(
+                [
+                    {"default_code": "NEW-01", "name": "Switch PoE"},
+                    {"default_code": "NEW-02", "name": "Doublon", "barcode": "3000000000001"},
+                ]
+            )
+
+        created = Product.objects.get(sku="NEW-01")
+        self.assertEqual(self._versions(created, Version.Action.CREATE), 1)
+        self.assertFalse(Product.objects.filter(sku="NEW-02").exists())
+        self.assertIn("nouveaux produits: 1", output)
+        self.assertIn("- NEW-02:", output)
+
+
+class SyncRemoteCategoriesCommandTests(_ImportCommandTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Product.objects.create(
+            sku="CAM-02",
+            manufacturer_reference="CAM-02",
+            name="Camera bullet",
+            brand=self.brand,
+            category=self.category,
+        )
+        Product.objects.filter(pk=self.other.pk).update(updated_at=self.old_timestamp)
+        self.payload = {
+            "results": [
+                {"sku": "CAM-01", "category": "Video", "subcategory": "Dome"},
+                {"sku": "CAM-02", "category": "Video", "subcategory": ""},
+                {"sku": "INCONNU", "category": "Video"},
+            ]
+        }
+
+    def _run(self):
+        response = MagicMock()
+        response.iter_content.return_value = [json.dumps(self.payload).encode("utf-8")]
+        output = StringIO()
+        with patch("inventory.management.commands.sync_remote_categories.requests.get") as get_mock:
+            get_mock.return_value.__enter__.return_value = response
+            call_command("sync_remote_categories", "--no-ai", stdout=output)
+        return output.getvalue()
+
+    def test_categories_are_saved_in_bulk(self):
+        output = self._run()
+
+        for product, subcategory in ((self.existing, "Dome"), (self.other, None)):
+            product.refresh_from_db()
+            self.assertEqual(product.category.name, "Video")
+            self.assertEqual(product.subcategory.name if product.subcategory else None, subcategory)
+            self.assertGreater(product.updated_at, self.old_timestamp)
+            self.assertEqual(self._versions(product, Version.Action.UPDATE), 1)
+        self.assertIn("produits maj: 2, erreurs: 0", output)
+
+    def test_rejected_product_is_skipped_when_the_bulk_update_fails(self):
+        original_save = Product.save
+
+        def save(product, *args, **kwargs):
+            if product.sku == "CAM-02":
+                raise DatabaseError("ligne refusee")
+            return original_save(product, *args, **kwargs)
+
+        with patch(
+            "django.db.models.query.QuerySet.bulk_update",
+            side_effect=DatabaseError("lot refuse"),
+        ), patch.object(Product, "save", autospec=True, side_effect=save):
+            output = self._run()
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.category.name, "Video")
+        self.assertGreater(self.existing.updated_at, self.old_timestamp)
+        self.assertEqual(self._versions(self.existing, Version.Action.UPDATE), 1)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.category, self.category)
+        self.assertEqual(self.other.updated_at, self.old_timestamp)
+        self.assertEqual(self._versions(self.other, Version.Action.UPDATE), 0)
+        self.assertIn("produits maj: 1, erreurs: 1", output)
+        self.assertIn("CAM-02", output)
+
+
+class ImportCustomersCommandTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "clients.xlsx"
+        self.existing = Customer.objects.create(reference="CLI-OLD", name="Awa Diallo")
+        self.old_timestamp = timezone.now() - timedelta(days=1)
+        Customer.objects.filter(pk=self.existing.pk).update(updated_at=self.old_timestamp)
+
+    # Un lot par ligne : la derniere ligne met a jour un client deja insere.
+    @patch("inventory.management.commands.import_customers.BATCH_SIZE", 1)
+    def test_customers_are_created_and_updated_in_bulk(self):
+        _write_workbook(
+            self.path,
+            [
+                ["Nom complet", "Telephone", "Email", "Ville"],
+                ["Awa Diallo", "770000001", "", "Dakar"],
+                ["Moussa Ba", "770000002", "", "Thies"],
+                ["", "770000003", "", ""],
+                ["Moussa Ba", "", "moussa@example.com", ""],
+            ],
+        )
+        output = StringIO()
+
+        call_command("import_customers", str(self.path), stdout=output)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.phone, "770000001")
+        self.assertEqual(self.existing.address, "Dakar")
+        self.assertGreater(self.existing.updated_at, self.old_timestamp)
+        self.assertEqual(
+            Version.for_instance(self.existing).filter(action=Version.Action.UPDATE).count(), 1
+        )
+        created = Customer.objects.get(name="Moussa Ba")
+        self.assertEqual(created.email, "moussa@example.com")
+        self.assertEqual(created.address, "Thies")
+        self.assertEqual(
+            Version.for_instance(created).filter(action=Version.Action.CREATE).count(), 1
+        )
+        self.assertEqual(
+            Version.for_instance(created).filter(action=Version.Action.UPDATE).count(), 1
+        )
+        self.assertIn("1 crees, 2 mis a jour, 1 ignores", output.getvalue())
+
+
+class UpdateProductCostsCommandTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "couts.xlsx"
+        self.product = Product.objects.create(
+            sku="HK-1",
+            manufacturer_reference="HK-1",
+            name="Camera",
+            brand=Brand.objects.create(name="Hikvision"),
+            category=Category.objects.create(name="Camera"),
+        )
+        self.old_timestamp = timezone.now() - timedelta(days=1)
+        Product.objects.filter(pk=self.product.pk).update(updated_at=self.old_timestamp)
+
+    def test_purchase_prices_are_updated_in_bulk(self):
+        _write_workbook(self.path, [["Reference", "Cout"], ["hk-1", 12.5], ["HK-404", 3]])
+        output = StringIO()
+
+        call_command("update_product_costs", str(self.path), stdout=output)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.purchase_price, Decimal("12.50"))
+        self.assertGreater(self.product.updated_at, self.old_timestamp)
+        self.assertEqual(
+            Version.for_instance(self.product).filter(action=Version.Action.UPDATE).count(), 1
+        )
+        self.assertIn("1 produits mis à jour, 1 références introuvables", output.getvalue())
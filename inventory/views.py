@@ -51,6 +51,8 @@ from .forms import (
     SaleItemFormSet,
     SaleAdjustmentItemForm,
     SaleReturnItemForm,
+    BaseSaleLineFormSet,
+    SCAN_PRODUCT_FIELDS,
 )
 from .models import (
     Brand,
@@ -2323,9 +2325,13 @@ def sale_return(request, pk):
         sale.items.filter(
             line_type=SaleItem.LineType.PRODUCT,
             product__isnull=False,
-        ).order_by("position", "id")
+        )
+        .select_related("product")
+        .order_by("position", "id")
+    )
+    ReturnFormSet = formset_factory(
+        SaleReturnItemForm, formset=BaseSaleLineFormSet, extra=0
     )
-    ReturnFormSet = formset_factory(SaleReturnItemForm, extra=0)
     initial_data = [
         {"sale_item_id": item.pk, "return_quantity": 0} for item in sale_items
     ]
@@ -2333,19 +2339,14 @@ def sale_return(request, pk):
         request.POST or None,
         prefix="returns",
         initial=initial_data,
+        sale_items=sale_items,
     )
     processed_items: list[tuple[SaleItem, int]] = []
     if request.method == "POST" and formset.is_valid():
-        sale_items_map = {item.pk: item for item in sale_items}
         has_errors = False
         for form in formset:
-            sale_item_id = form.cleaned_data.get("sale_item_id")
             quantity = form.cleaned_data.get("return_quantity") or 0
-            sale_item = sale_items_map.get(sale_item_id)
-            if sale_item is None:
-                form.add_error(None, "Ligne invalide.")
-                has_errors = True
-                continue
+            sale_item = form.sale_item
             if quantity > sale_item.available_return_quantity:
                 form.add_error(
                     "return_quantity",
@@ -2415,9 +2416,13 @@ def sale_adjust(request, pk):
         sale.items.filter(
             line_type=SaleItem.LineType.PRODUCT,
             product__isnull=False,
-        ).order_by("position", "id")
+        )
+        .select_related("product")
+        .order_by("position", "id")
+    )
+    AdjustmentFormSet = formset_factory(
+        SaleAdjustmentItemForm, formset=BaseSaleLineFormSet, extra=0
     )
-    AdjustmentFormSet = formset_factory(SaleAdjustmentItemForm, extra=0)
     initial_data = [
         {
             "sale_item_id": item.pk,
@@ -2430,21 +2435,16 @@ def sale_adjust(request, pk):
         request.POST or None,
         prefix="adjust",
         initial=initial_data,
+        sale_items=sale_items,
     )
     form_rows = list(zip(formset.forms, sale_items))
     if request.method == "POST" and formset.is_valid():
-        sale_items_map = {item.pk: item for item in sale_items}
         rows_to_process: list[tuple[SaleItem, int, Decimal]] = []
         has_errors = False
         for form in formset:
-            sale_item_id = form.cleaned_data.get("sale_item_id")
             keep_quantity = form.cleaned_data.get("keep_quantity") or 0
             unit_price = form.cleaned_data.get("unit_price")
-            sale_item = sale_items_map.get(sale_item_id)
-            if sale_item is None:
-                form.add_error(None, "Ligne invalide.")
-                has_errors = True
-                continue
+            sale_item = form.sale_item
             available_quantity = max(sale_item.quantity - sale_item.returned_quantity, 0)
             if keep_quantity > available_quantity:
                 form.add_error(
@@ -2731,7 +2731,7 @@ def quote_edit(request, pk):
     else:
         sale_form = SaleForm(instance=sale)
         initial_items = []
-        for item in sale.items.select_related("product").order_by("position", "id"):
+        for item in sale.items_for_edit_form():
             initial_items.append(
                 {
                     "line_type": item.line_type,
@@ -2896,8 +2896,7 @@ def scan_sale_product(request):
     code = (request.GET.get("code") or "").strip()
     if not code:
         return JsonResponse({"found": False, "error": "Code requis."}, status=400)
-    product_qs = Product.objects.for_scan_code(code)
-    product = product_qs.first()
+    product = Product.objects.for_scan_code(code).only(*SCAN_PRODUCT_FIELDS).first()
     if not product:
         return JsonResponse({"found": False, "code": code})
     scan = SaleScan.objects.create(